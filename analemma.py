@@ -3,32 +3,38 @@
 # Simulate analemma photo based on GPS info, DSLR's orientation, DSLR's CMOS info
 
 from sunposition import sunpos
+import raster
+import geolocation
 from datetime import datetime,timedelta
-import urllib2
 import json
+import csv
+import copy
+import time
+import traceback
 import argparse
 import sys
 import math
 import numpy as np
-import matplotlib.pyplot as plt
-
-def getIPAddress():
-    response = urllib2.urlopen("http://httpbin.org/ip")
-    content = response.read()
-    jsonContent = json.loads(content)
-    IP = jsonContent["origin"].split(",")[0]
-    print "ip=%s" % IP
-    return IP
-
-def getLatitudeLongitude():
-    print "auto detecting latitude&longitude, may be very slow"
-    IP = getIPAddress()
-    response = urllib2.urlopen("http://ipinfo.io/" + IP)
-    content = response.read()
-    jsonContent = json.loads(content)
-    latitude,longitude = jsonContent["loc"].split(",")
-    latitude = float(latitude)
-    longitude = float(longitude)
+
+def getPyplot():
+    # matplotlib is imported only when plotting with it, importing it takes longer than everything else at startup
+    import matplotlib.pyplot as plt
+    return plt
+
+def startLocating(args):
+    # start looking the location up in the background if it isn't given, getLatitudeLongitude waits for it
+    if args.latitude != None and args.longitude != None:
+        return None
+    cache = args.location_cache if args.location_cache else None
+    return geolocation.Resolver(args.locator, args.locator_timeout, cache, args.location_max_age*3600).start()
+
+def getLatitudeLongitude(resolver):
+    print "auto detecting latitude&longitude with %s" % resolver.locator
+    try:
+        latitude,longitude = resolver.result()
+    except geolocation.LocationError as e:
+        print "%s, please set --latitude and --longitude" % e
+        sys.exit(-1)
     print "latitude=%f longitude=%f" % (latitude, longitude)
     return latitude,longitude
 
@@ -41,13 +47,27 @@ def getDateTimes(date, npoints_before, npoints_after):
 
 def getSolarPositions(args):
     dates = getDateTimes(args.datetime, args.npoints_before, args.npoints_after)
-    azimuth_list = []
-    zenith_list = []
-    for date in dates:
-        azimuth,zenith = sunpos(date, latitude=args.latitude, longitude=args.longitude, elevation=args.elevation)[:2]
-        azimuth_list.append(azimuth)
-        zenith_list.append(zenith)
-    return azimuth_list,zenith_list
+    result = sunpos(dates, latitude=args.latitude, longitude=args.longitude, elevation=args.elevation, columns=(0, 1))
+    return result[:,0],result[:,1]
+
+def getDateTimeGrid(date, days, hours):
+    # (days, hours) grid of numpy.datetime64: every day from date's day, at each of the hours (UTC, may be fractional)
+    # plus date's minutes and seconds
+    start = np.datetime64(datetime(date.year, date.month, date.day), 's')
+    offset = date.minute*60 + date.second
+    dayOffsets = np.arange(days)*86400
+    hourOffsets = np.round(np.asarray(hours, dtype=float)*3600).astype(np.int64) + offset
+    return start + (dayOffsets[:,None] + hourOffsets[None,:]).astype('timedelta64[s]')
+
+def getAnalemmaFamily(args, days=365, hours=range(24)):
+    # the analemma of every hour at once, from one sunpos call over the (days, hours) grid and the batch projection
+    # returns the grid of datetimes, the projections in mm (days, hours, 2), and the masks (days, hours)
+    # of the points above the horizon and of the points inside the frame (in front of the camera and on the sensor)
+    dates = getDateTimeGrid(args.datetime, days, hours)
+    positions = sunpos(dates, latitude=args.latitude, longitude=args.longitude, elevation=args.elevation, columns=(0, 1))
+    projections,valid,inside = projectAzimuthZenith(args, positions[...,0], positions[...,1])
+    aboveHorizon = valid & (positions[...,1] < 90.0)
+    return dates, projections, aboveHorizon, valid & inside
 
 # Coordinate System Transforms
 def worldAzimuthZenith2WorldPoint(sunAzimuth, sunZenith):
@@ -61,11 +81,15 @@ def worldAzimuthZenith2WorldPoint(sunAzimuth, sunZenith):
     worldPoint = np.array([[xWorld],[yWorld],[zWorld]])
     return worldPoint
 
-def worldPoint2ViewPoint(worldPoint, cameraAzimuth, cameraPitch, cameraRoll):
+def cameraMatrix(cameraAzimuth, cameraPitch, cameraRoll):
     Rx = np.array([[1,0,0], [0, math.cos(cameraPitch/180.0*math.pi), -math.sin(cameraPitch/180.0*math.pi)], [0, math.sin(cameraPitch/180.0*math.pi), math.cos(cameraPitch/180.0*math.pi)]])
     Ry = np.array([[math.cos(cameraRoll/180.0*math.pi),0,math.sin(cameraRoll/180.0*math.pi)], [0,1,0], [-math.sin(cameraRoll/180.0*math.pi),0,math.cos(cameraRoll/180.0*math.pi)]])
     Rz = np.array([[math.cos(cameraAzimuth/180.0*math.pi), -math.sin(cameraAzimuth/180.0*math.pi), 0], [math.sin(cameraAzimuth/180.0*math.pi), math.cos(cameraAzimuth/180.0*math.pi), 0], [0,0,1]])
     matrix = np.dot(Ry, np.dot(Rx, Rz))
+    return matrix
+
+def worldPoint2ViewPoint(worldPoint, cameraAzimuth, cameraPitch, cameraRoll):
+    matrix = cameraMatrix(cameraAzimuth, cameraPitch, cameraRoll)
     viewPoint = np.dot(matrix, worldPoint)
     return viewPoint
 
@@ -89,6 +113,40 @@ def viewPoint2Projection(viewPoint, focal_length, sensor_width, sensor_height, f
         return None
     return xInMM,yInMM
 
+# Batch versions of the transforms above, points are rows of (N,3) or (N,2) arrays
+# and a boolean mask marks the rows that are valid instead of exiting or returning None
+
+def worldAzimuthZenith2WorldPoints(sunAzimuth, sunZenith):
+    sunAzimuth = np.asarray(sunAzimuth, dtype=float)
+    sunZenith = np.asarray(sunZenith, dtype=float)
+    valid = (sunAzimuth >= 0) & (sunAzimuth <= 360) & (sunZenith >= 0) & (sunZenith <= 180)
+    sunDistanceInMM = 1.496*math.pow(10, 14) # in mm
+    azimuth = np.deg2rad(sunAzimuth)
+    zenith = np.deg2rad(sunZenith)
+    worldPoints = np.empty(sunAzimuth.shape + (3,))
+    worldPoints[...,0] = sunDistanceInMM*np.sin(zenith)*np.sin(azimuth)
+    worldPoints[...,1] = sunDistanceInMM*np.sin(zenith)*np.cos(azimuth)
+    worldPoints[...,2] = sunDistanceInMM*np.cos(zenith)
+    return worldPoints,valid
+
+def worldPoints2ViewPoints(worldPoints, matrix):
+    # matrix is cameraMatrix(...), composed once for all of the points
+    return np.dot(worldPoints, matrix.T)
+
+def viewPoints2Projections(viewPoints, focal_length, sensor_width, sensor_height, facing_back):
+    x = viewPoints[...,0]
+    y = viewPoints[...,1]
+    z = viewPoints[...,2]
+    if facing_back == True:
+        z = -z
+    inFront = z > 0.0
+    depth = np.where(inFront, z, 1.0)
+    projections = np.empty(viewPoints.shape[:-1] + (2,))
+    projections[...,0] = focal_length*x/depth
+    projections[...,1] = focal_length*y/depth
+    inside = inFront & (np.abs(projections[...,0]) <= sensor_width/2) & (np.abs(projections[...,1]) <= sensor_height/2)
+    return projections,inside
+
 # end of Coordinate System Transforms
 
 def mm2Pixel(args, point):
@@ -96,32 +154,50 @@ def mm2Pixel(args, point):
     yInPixel = (-point[1] + args.sensor_height/2.0)/args.sensor_height*args.pixel_height
     return int(xInPixel),int(yInPixel)
 
+def mm2Pixels(args, points):
+    xInPixel = (points[...,0] + args.sensor_width/2.0)/args.sensor_width*args.pixel_width
+    yInPixel = (-points[...,1] + args.sensor_height/2.0)/args.sensor_height*args.pixel_height
+    return xInPixel.astype(int),yInPixel.astype(int)
+
+def projectAzimuthZenith(args, sunAzimuth, sunZenith, matrix=None):
+    # the whole chain from the Sun's azimuth&zenith to projections in mm, with the masks of the valid positions
+    # and of the points inside the frame, matrix is the camera's orientation if it isn't args.camera_azimuth/pitch/roll
+    worldPoints,valid = worldAzimuthZenith2WorldPoints(sunAzimuth, sunZenith)
+    if matrix is None:
+        matrix = cameraMatrix(args.camera_azimuth, args.camera_pitch, args.camera_roll)
+    viewPoints = worldPoints2ViewPoints(worldPoints, matrix)
+    projections,inside = viewPoints2Projections(viewPoints, args.focal_length, args.sensor_width, args.sensor_height, args.facing_back)
+    return projections,valid,inside
+
 def getPoints(args):
-    azimuth_list,zenith_list = getSolarPositions(args)
-    xs = []
-    ys = []
-    colors = []
-    for i in range(len(azimuth_list)):
-        worldPoint = worldAzimuthZenith2WorldPoint(azimuth_list[i], zenith_list[i])
-        viewPoint = worldPoint2ViewPoint(worldPoint, args.camera_azimuth, args.camera_pitch, args.camera_roll)
-        ret = viewPoint2Projection(viewPoint, args.focal_length, args.sensor_width, args.sensor_height, args.facing_back)
-        if not ret:
-            continue;
-        if i == args.npoints_before - 1:
-            colors.append("#ff0000")
-        elif i == args.npoints_before:
-            colors.append("#00ff00")
-        elif i == args.npoints_before + 1:
-            colors.append("#0000ff")
-        else:
-            colors.append("#ffff00")
-        xs.append(ret[0])
-        ys.append(ret[1])
-        xInPixel,yInPixel = mm2Pixel(args, ret)
-        print "In image (x,y) = (%d,%d)" % (xInPixel,yInPixel)
-    return xs,ys,colors
+    azimuths,zeniths = getSolarPositions(args)
+    projections,valid,inside = projectAzimuthZenith(args, azimuths, zeniths)
+    if not np.all(valid):
+        print "worldAzimuthZenith2WorldPoints wrong argument"
+        sys.exit(-1)
+    index = np.flatnonzero(inside)
+    colors = np.array(["#ffff00"]*len(azimuths), dtype=object)
+    for i,color in zip(range(args.npoints_before - 1, args.npoints_before + 2), ["#ff0000", "#00ff00", "#0000ff"]):
+        if 0 <= i < len(colors):
+            colors[i] = color
+    xInPixel,yInPixel = mm2Pixels(args, projections[index])
+    for x,y in zip(xInPixel, yInPixel):
+        print "In image (x,y) = (%d,%d)" % (x,y)
+    return list(projections[index,0]),list(projections[index,1]),list(colors[index])
+
+def getFamilyPoints(args):
+    # the visible points of the analemma of every hour, the day of args.datetime in green
+    dates, projections, aboveHorizon, inFrame = getAnalemmaFamily(args)
+    visible = aboveHorizon & inFrame
+    for hour in range(visible.shape[1]):
+        print "%02d:%02d UTC: %d of %d days visible" % (hour, args.datetime.minute, np.count_nonzero(visible[:,hour]), visible.shape[0])
+    colors = np.empty(visible.shape, dtype=object)
+    colors[:] = "#ffff00"
+    colors[0] = "#00ff00"
+    return list(projections[visible][:,0]),list(projections[visible][:,1]),list(colors[visible])
 
 def plot(args, xs, ys, colors):
+    plt = getPyplot()
     fig, ax = plt.subplots()
     bbox = ax.get_window_extent().transformed(fig.dpi_scale_trans.inverted())
     sun_diameter_in_mm = 1.392/149.6*args.focal_length
@@ -135,10 +211,32 @@ def plot(args, xs, ys, colors):
     ax.set_aspect('equal');
     if args.save:
         plt.savefig(args.save)
+        plt.close(fig)
     else:
         plt.show()
 
-def main():
+def rasterPlot(args, xs, ys, colors):
+    # draw the suns at pixel_width x pixel_height straight into an RGBA image, transparent outside of the suns
+    sun_diameter_in_mm = 1.392/149.6*args.focal_length
+    sun_diameter_in_pixel = sun_diameter_in_mm/args.sensor_width*args.pixel_width
+    xInPixel = (np.asarray(xs) + args.sensor_width/2.0)/args.sensor_width*args.pixel_width
+    yInPixel = (-np.asarray(ys) + args.sensor_height/2.0)/args.sensor_height*args.pixel_height
+    image = raster.newImage(args.pixel_width, args.pixel_height)
+    raster.drawDisks(image, xInPixel, yInPixel, sun_diameter_in_pixel, colors)
+    raster.writePNG(args.save, image)
+
+def overlayPlot(args, xs, ys, colors):
+    # draw the suns onto the uncompressed photo in args.overlay, it must be pixel_width x pixel_height
+    sun_diameter_in_mm = 1.392/149.6*args.focal_length
+    sun_diameter_in_pixel = sun_diameter_in_mm/args.sensor_width*args.pixel_width
+    xInPixel = (np.asarray(xs) + args.sensor_width/2.0)/args.sensor_width*args.pixel_width
+    yInPixel = (-np.asarray(ys) + args.sensor_height/2.0)/args.sensor_height*args.pixel_height
+    shape = raster.openFrame(args.overlay, "r", args.pixel_width, args.pixel_height).shape
+    if shape[:2] != (args.pixel_height, args.pixel_width):
+        raise ValueError("photo %s is %dx%d, not %dx%d" % (args.overlay, shape[1], shape[0], args.pixel_width, args.pixel_height))
+    raster.overlay(args.overlay, args.save, xInPixel, yInPixel, sun_diameter_in_pixel, colors, args.pixel_width, args.pixel_height)
+
+def getParser():
     parser = argparse.ArgumentParser()
     parser.description = "draw analemma, the Sun runs from red point to green point to blue point"
     parser.add_argument("--camera_azimuth", default=-1000, help="azimuth", type=float)
@@ -154,16 +252,25 @@ def main():
     parser.add_argument("--datetime", default=datetime.utcnow(), help="UTC datetime in format %%Y-%%m-%%d H:M:S", type=lambda s: datetime.strptime(s, '%Y-%m-%d %H:%M:%S'))
     parser.add_argument("--npoints_before", default=15, help="number of points before datetime", type=int)
     parser.add_argument("--npoints_after", default=15, help="number of points after datetime", type=int)
+    parser.add_argument("--family", action="store_true", help="draw the analemma of every hour of the day instead, one point per day for a year from datetime")
 
     parser.add_argument("--latitude", help="latitude", type=float)
     parser.add_argument("--longitude", help="longitude", type=float)
     parser.add_argument("--elevation", default=0, help="elevation", type=float)
+    parser.add_argument("--locator", default="ipinfo", help="where to look latitude&longitude up when they aren't given: ipinfo, a URL answering JSON like ipinfo.io, or file:PATH of such JSON", type=str)
+    parser.add_argument("--locator_timeout", default=5.0, help="seconds to wait for the locator", type=float)
+    parser.add_argument("--location_cache", default=geolocation.CACHE, help="file caching the located latitude&longitude, empty to disable", type=str)
+    parser.add_argument("--location_max_age", default=24.0, help="hours a cached location is used for", type=float)
 
     parser.add_argument("--save", metavar="FILENAME", nargs="?", const="analemma.png", help="save image", type=str)
+    parser.add_argument("--raster", action="store_true", help="save a pixel_width x pixel_height PNG drawn without matplotlib, transparent outside of the suns")
+    parser.add_argument("--overlay", metavar="PHOTO", help="draw the suns onto a copy of an uncompressed photo (binary PPM, .npy or raw RGB bytes), saved as PNG or in the photo's format", type=str)
 
-    args = parser.parse_args()
-    if args.latitude == None or args.longitude == None:
-        args.latitude, args.longitude = getLatitudeLongitude()
+    parser.add_argument("--manifest", metavar="FILENAME", help="render every row of a CSV or JSON file of the options above, one image per row", type=str)
+    parser.add_argument("--workers", help="number of processes rendering the manifest, default is the number of CPUs", type=int)
+    return parser
+
+def setDefaultOrientation(args):
     if args.camera_azimuth == -1000 or args.camera_pitch == -1000 or args.camera_roll == -1000:
         marchDateTime = args.datetime - timedelta(days = (args.datetime.month - 3)*30)
         default_azimuth, default_zenith = sunpos(marchDateTime, latitude=args.latitude, longitude=args.longitude, elevation=args.elevation)[:2]
@@ -194,8 +301,133 @@ def main():
         print "default camera_azimuth is %f" % args.camera_azimuth
         print "default camera_pitch is %f" % args.camera_pitch
         print "default camera_roll is %f" % args.camera_roll
-    xs, ys, colors = getPoints(args)
-    plot(args, xs, ys, colors)
+
+def render(args):
+    setDefaultOrientation(args)
+    if args.family:
+        xs, ys, colors = getFamilyPoints(args)
+    else:
+        xs, ys, colors = getPoints(args)
+    if args.raster or args.overlay:
+        if not args.save:
+            args.save = "analemma.png"
+        if args.overlay:
+            overlayPlot(args, xs, ys, colors)
+        else:
+            rasterPlot(args, xs, ys, colors)
+    else:
+        plot(args, xs, ys, colors)
+
+# Batch mode: a manifest is a CSV file with a header row of option names, or a JSON list of objects,
+# each row is parsed like the command line on top of the options given on the command line
+
+def readManifest(filename):
+    with open(filename) as f:
+        if filename.lower().endswith(".json"):
+            rows = json.load(f)
+        else:
+            rows = list(csv.DictReader(f))
+    return rows
+
+def isTrue(value):
+    # booleans of JSON rows, and the cells of CSV rows
+    if isinstance(value, basestring):
+        return value.strip().lower() in ("true", "yes", "1")
+    return bool(value)
+
+def rowArgv(parser, row):
+    # command line of a manifest row, switches such as --raster are given without a value when true and left out when false
+    argv = []
+    for key, value in row.items():
+        if value is None or value == "":
+            continue
+        action = parser._option_string_actions.get("--" + key)
+        if isinstance(action, argparse._StoreTrueAction):
+            if isTrue(value):
+                argv.append("--" + key)
+            continue
+        argv += ["--" + key, str(value)]
+    return argv
+
+def manifestArgs(parser, args, rows, resolver=None):
+    scenes = []
+    failures = []
+    for index, row in enumerate(rows):
+        argv = rowArgv(parser, row)
+        try:
+            sceneArgs = parser.parse_args(argv, namespace=copy.copy(args))
+        except SystemExit:
+            failures.append((index, "bad manifest row %s" % row))
+            continue
+        if not sceneArgs.save:
+            sceneArgs.save = "analemma_%d.png" % index
+        if sceneArgs.latitude == None or sceneArgs.longitude == None:
+            if args.latitude == None or args.longitude == None:
+                # a failed lookup only fails the rows that need it, the resolver keeps its error for the next ones
+                resolver = resolver or startLocating(args)
+                try:
+                    args.latitude, args.longitude = resolver.result()
+                except geolocation.LocationError as e:
+                    failures.append((index, "no latitude&longitude, %s" % e))
+                    continue
+                print "latitude=%f longitude=%f located with %s" % (args.latitude, args.longitude, resolver.locator)
+            sceneArgs.latitude, sceneArgs.longitude = args.latitude, args.longitude
+        scenes.append((index, sceneArgs))
+    return scenes, failures
+
+def useHeadlessBackend():
+    # select the headless backend before pyplot is first imported, in the scene's try block so that
+    # a broken matplotlib fails the scenes plotting with it instead of every worker of the pool
+    import matplotlib
+    matplotlib.use("Agg")
+
+def renderScene(scene):
+    index, args = scene
+    start = time.time()
+    try:
+        if not (args.raster or args.overlay):
+            useHeadlessBackend()
+        render(args)
+        error = None
+    except (Exception, SystemExit):
+        error = traceback.format_exc()
+    return index, args.save, time.time() - start, error
+
+def renderManifest(parser, args, resolver=None):
+    start = time.time()
+    rows = readManifest(args.manifest)
+    total = len(rows)
+    scenes, failures = manifestArgs(parser, args, rows, resolver)
+    for index, error in failures:
+        print "scene %d failed: %s" % (index, error)
+    import multiprocessing
+    pool = multiprocessing.Pool(max(args.workers or multiprocessing.cpu_count(), 1))
+    try:
+        for index, save, seconds, error in pool.imap_unordered(renderScene, scenes):
+            if error:
+                failures.append((index, error))
+                print "scene %d failed in %f s:\n%s" % (index, seconds, error)
+            else:
+                print "scene %d rendered to %s in %f s" % (index, save, seconds)
+    finally:
+        pool.close()
+        pool.join()
+    print "rendered %d scenes, %d failed, in %f s" % (total - len(failures), len(failures), time.time() - start)
+    return failures
+
+def main():
+    parser = getParser()
+    args = parser.parse_args()
+    # the lookup runs while the manifest is read or matplotlib is imported, manifests giving every row's location never wait for it
+    resolver = startLocating(args)
+    if args.manifest:
+        failures = renderManifest(parser, args, resolver)
+        sys.exit(1 if failures else 0)
+    if resolver:
+        if not (args.raster or args.overlay):
+            getPyplot()
+        args.latitude, args.longitude = getLatitudeLongitude(resolver)
+    render(args)
 
 if __name__ == "__main__":
     main()
@@ -6,13 +6,13 @@
 # 3. change camera_azimuth and try different azimuth_error until delta_x&delta_y between real sun and calculated sun fixed
 # 4. try different pitch_error until delta_y become zero
 # 5. try different roll_error until delta_x become zero
+# sweep() projects the sun for a whole azimuth x pitch x roll grid of errors at once, to look the offsets up instead
 
 from sunposition import sunpos
 from datetime import datetime
 import sys
 import math
 import numpy as np
-import matplotlib.pyplot as plt
 
 latitude = 40.0
 longitude = 116.0
@@ -21,6 +21,8 @@ elevation = 0
 focal_length = 35
 sensor_width = 36
 sensor_height = 24
+pixel_width = 5760
+pixel_height = 3840
 facing_back = True
 
 # utc
@@ -70,6 +72,43 @@ def viewPoint2Projection(viewPoint, focal_length, sensor_width, sensor_height, f
         return None
     return xInMM,yInMM
 
+def cameraMatrices(cameraAzimuths, cameraPitches, cameraRolls):
+    # stack of the matrices of worldPoint2ViewPoint for every combination, shape (azimuths, pitches, rolls, 3, 3)
+    a = np.deg2rad(np.asarray(cameraAzimuths, dtype=float).ravel())
+    p = np.deg2rad(np.asarray(cameraPitches, dtype=float).ravel())
+    r = np.deg2rad(np.asarray(cameraRolls, dtype=float).ravel())
+    Rx = np.zeros((len(p), 3, 3))
+    Rx[:,0,0] = 1
+    Rx[:,1,1] = np.cos(p)
+    Rx[:,1,2] = -np.sin(p)
+    Rx[:,2,1] = np.sin(p)
+    Rx[:,2,2] = np.cos(p)
+    Ry = np.zeros((len(r), 3, 3))
+    Ry[:,0,0] = np.cos(r)
+    Ry[:,0,2] = np.sin(r)
+    Ry[:,1,1] = 1
+    Ry[:,2,0] = -np.sin(r)
+    Ry[:,2,2] = np.cos(r)
+    Rz = np.zeros((len(a), 3, 3))
+    Rz[:,0,0] = np.cos(a)
+    Rz[:,0,1] = -np.sin(a)
+    Rz[:,1,0] = np.sin(a)
+    Rz[:,1,1] = np.cos(a)
+    Rz[:,2,2] = 1
+    RxRz = np.einsum('pjk,akl->apjl', Rx, Rz)
+    return np.einsum('rij,apjl->april', Ry, RxRz)
+
+def viewPoints2Projections(viewPoints, focal_length, sensor_width, sensor_height, facing_back):
+    # viewPoints (...,3), returns projections (...,2) in mm and the mask of the ones inside the sensor
+    z = viewPoints[...,2]
+    if facing_back == True:
+        z = -z
+    inFront = z > 0.0
+    depth = np.where(inFront, z, 1.0)
+    projections = focal_length*viewPoints[...,:2]/depth[...,None]
+    inside = inFront & (np.abs(projections[...,0]) <= sensor_width/2) & (np.abs(projections[...,1]) <= sensor_height/2)
+    return projections,inside
+
 # end of Coordinate System Transforms
 
 def getPoint(date, camera_azimuth, camera_pitch, camera_roll):
@@ -83,7 +122,23 @@ def getPoint(date, camera_azimuth, camera_pitch, camera_roll):
     print "x=%f y=%f" % (projectionPoint[0], projectionPoint[1])
     return projectionPoint
 
+def sweep(date, camera_azimuth, camera_pitch, camera_roll, azimuth_errors, pitch_errors, roll_errors):
+    # project the sun for every combination of the orientation errors, the sun's position and the
+    # rotation matrices are computed once and all of the orientations are projected together
+    # returns dx,dy,inside with shape (len(azimuth_errors), len(pitch_errors), len(roll_errors)):
+    # the offsets in pixel from where the sun is with no error (NaN if it is off the sensor) and the mask of the ones on the sensor
+    azimuth, zenith = getSolarPosition(date)
+    worldPoint = worldAzimuthZenith2WorldPoint(azimuth, zenith)[:,0]
+    projection,_ = viewPoints2Projections(worldPoint2ViewPoint(worldPoint, camera_azimuth, camera_pitch, camera_roll), focal_length, sensor_width, sensor_height, facing_back)
+    matrices = cameraMatrices(camera_azimuth + np.asarray(azimuth_errors), camera_pitch + np.asarray(pitch_errors), camera_roll + np.asarray(roll_errors))
+    viewPoints = np.einsum('...ij,j->...i', matrices, worldPoint)
+    projections,inside = viewPoints2Projections(viewPoints, focal_length, sensor_width, sensor_height, facing_back)
+    dx = np.where(inside, (projections[...,0] - projection[0])/sensor_width*pixel_width, np.nan)
+    dy = np.where(inside, -(projections[...,1] - projection[1])/sensor_height*pixel_height, np.nan)
+    return dx,dy,inside
+
 def plot(xs, ys, colors):
+    import matplotlib.pyplot as plt # only needed by the demo, sweep() works without it
     fig, ax = plt.subplots()
     bbox = ax.get_window_extent().transformed(fig.dpi_scale_trans.inverted())
     sun_diameter_in_mm = 1.392/149.6*focal_length
@@ -97,34 +152,30 @@ def plot(xs, ys, colors):
     ax.set_aspect('equal');
     plt.show()
 
-camera_azimuth = 20
-camera_pitch = -18
-camera_roll = 170
-
-delta = 1
-npoints = 10
+def main():
+    camera_azimuth = 20
+    camera_pitch = -18
+    camera_roll = 170
 
-projectionPoints = []
-colors = []
+    delta = 1
+    npoints = 10
 
-projectionPoint = getPoint(date, camera_azimuth, camera_pitch, camera_roll)
-projectionPoints.append(projectionPoint)
-colors.append("#00ff00")
-
-for i in range(npoints):
-    projectionPoint = getPoint(date, camera_azimuth+(i+1)*delta, camera_pitch, camera_roll)
-    if projectionPoint:
-        projectionPoints.append(projectionPoint)
-        colors.append("#ff0000")
-
-    projectionPoint = getPoint(date, camera_azimuth, camera_pitch+(i+1)*delta, camera_roll)
-    if projectionPoint:
-        projectionPoints.append(projectionPoint)
-        colors.append("#0000ff")
-
-    projectionPoint = getPoint(date, camera_azimuth, camera_pitch, camera_roll+(i+1)*delta)
-    if projectionPoint:
-        projectionPoints.append(projectionPoint)
-        colors.append("#ffff00")
-
-plot([point[0] for point in projectionPoints], [point[1] for point in projectionPoints], colors)
+    projectionPoint = getPoint(date, camera_azimuth, camera_pitch, camera_roll)
+    if not projectionPoint:
+        return
+    errors = np.arange(npoints + 1)*delta
+    dx, dy, inside = sweep(date, camera_azimuth, camera_pitch, camera_roll, errors, errors, errors)
+    xs = [projectionPoint[0]]
+    ys = [projectionPoint[1]]
+    colors = ["#00ff00"]
+    # the points with an error on one axis only
+    for field, color in [((dx[1:,0,0], dy[1:,0,0]), "#ff0000"), ((dx[0,1:,0], dy[0,1:,0]), "#0000ff"), ((dx[0,0,1:], dy[0,0,1:]), "#ffff00")]:
+        ok = ~np.isnan(field[0])
+        xs.extend(projectionPoint[0] + field[0][ok]/pixel_width*sensor_width)
+        ys.extend(projectionPoint[1] - field[1][ok]/pixel_height*sensor_height)
+        colors.extend([color]*np.count_nonzero(ok))
+    print "%d of %d orientations keep the sun on the sensor" % (np.count_nonzero(inside), inside.size)
+    plot(xs, ys, colors)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/python
+
+# Check the startup time of the command line tools against the budget in README.md ("Startup time")
+# Every module is imported in a fresh interpreter, the time counted is on top of importing numpy, which all of them need,
+# and none of the modules that are only imported on use (plotting, network, process pools) may be loaded by the import
+# The tools are Python 2, the interpreter timed is the one given with --python, by default the one running this script
+
+import subprocess
+import argparse
+import sys
+
+# seconds on top of "import numpy"
+BUDGET = {
+    "sunposition": 0.03,
+    "analemma": 0.05,
+    "orientation": 0.05,
+    "analyze_orientation_error": 0.04,
+    "ephemeris": 0.04,
+    "raster": 0.02,
+    "geolocation": 0.02,
+}
+LAZY = ["matplotlib", "urllib2", "urllib.request", "multiprocessing"]
+
+PROGRAM = """
+import time, sys
+start = time.time()
+import numpy
+numpy_time = time.time() - start
+import %s
+print("%%f %%f" %% (numpy_time, time.time() - start - numpy_time))
+print(" ".join(sorted(m for m in %r if m in sys.modules)))
+"""
+
+class ImportFailed(Exception):
+    pass
+
+def measure(module, repeat, python):
+    times = []
+    for i in range(repeat):
+        try:
+            output = subprocess.check_output([python, "-c", PROGRAM % (module, LAZY)], stderr=subprocess.STDOUT).decode().split("\n")
+        except subprocess.CalledProcessError as e:
+            lines = e.output.decode().strip().split("\n")
+            raise ImportFailed(lines[-1])
+        except OSError as e:
+            raise ImportFailed("can't run %s: %s" % (python, e))
+        times.append(float(output[0].split()[1]))
+        loaded = output[1].split()
+    times.sort()
+    return times[len(times)//2], loaded
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.description = "measure the import time of each tool in fresh interpreters and compare the median with its budget"
+    parser.add_argument("--repeat", default=7, help="number of interpreters started for each module", type=int)
+    parser.add_argument("--scale", default=1.0, help="multiply the budgets, for machines slower than the reference one", type=float)
+    parser.add_argument("--python", default=sys.executable, help="Python 2 interpreter to time the imports with, default is the one running this script", type=str)
+    args = parser.parse_args()
+
+    failed = False
+    importFailed = False
+    for module in sorted(BUDGET):
+        budget = BUDGET[module]*args.scale
+        try:
+            seconds, loaded = measure(module, args.repeat, args.python)
+        except ImportFailed as e:
+            failed = importFailed = True
+            print("%-28s import FAILED: %s" % (module, e))
+            continue
+        ok = seconds <= budget and not loaded
+        failed = failed or not ok
+        print("%-28s %6.1f ms (budget %5.1f ms) %s%s" % (module, seconds*1000, budget*1000, "ok" if ok else "OVER",
+                                                       " loaded " + ",".join(loaded) if loaded else ""))
+    if importFailed:
+        print("the tools need Python 2, give its interpreter with --python if this one isn't")
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
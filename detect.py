@@ -0,0 +1,148 @@
+#!/usr/bin/python
+
+# Find the Sun in a sequence of photos and feed the observations to orientation.py
+# Frames are memory-mapped (raster.openFrame) and only a window around where the Sun is expected is read. The window comes
+# from the orientation solved from the frames so far, or from --camera_azimuth/pitch/roll, and a frame is only searched
+# in full, at a coarse stride, while there is no prediction yet or when the Sun isn't in the window.
+
+from sunposition import sunpos
+from analemma import projectAzimuthZenith, cameraMatrix, mm2Pixels
+from orientation import OrientationEstimator
+from datetime import datetime
+import raster
+import argparse
+import json
+import sys
+import os
+import numpy as np
+
+FRAME_EXTENSIONS = (".ppm", ".pnm", ".npy", ".raw")
+
+def frameTime(filename, time_format):
+    # UTC capture time from the file name without its extension
+    return datetime.strptime(os.path.splitext(os.path.basename(filename))[0], time_format)
+
+def sunDiameterInPixel(args):
+    return 1.392/149.6*args.focal_length/args.sensor_width*args.pixel_width
+
+def findSun(window, threshold, diameter):
+    # sub-pixel centroid (x, y) of the saturated disk in window, None if there are less saturated pixels than a quarter of it
+    # the disk is the saturated pixels within a diameter of their median, so flares and reflections elsewhere are ignored,
+    # and each pixel of its bounding box is weighted by its brightness between threshold/2 and threshold to get the edges
+    # the alpha channel of RGBA frames is left out, it is opaque all over
+    luminance = window[...,:3].max(axis=2) if window.ndim == 3 else window
+    ys, xs = np.nonzero(luminance >= threshold)
+    if len(xs) < max(np.pi*diameter*diameter/16, 1):
+        return None
+    near = np.hypot(xs - np.median(xs), ys - np.median(ys)) <= diameter
+    xs, ys = xs[near], ys[near]
+    if len(xs) < max(np.pi*diameter*diameter/16, 1):
+        return None
+    x0 = max(xs.min() - 2, 0)
+    x1 = min(xs.max() + 3, luminance.shape[1])
+    y0 = max(ys.min() - 2, 0)
+    y1 = min(ys.max() + 3, luminance.shape[0])
+    low = threshold/2.0
+    weights = np.clip((luminance[y0:y1,x0:x1].astype(float) - low)/(threshold - low), 0.0, 1.0)
+    total = weights.sum()
+    x = np.dot(weights.sum(axis=0), np.arange(x0, x1) + 0.5)/total
+    y = np.dot(weights.sum(axis=1), np.arange(y0, y1) + 0.5)/total
+    return x, y
+
+def predictSun(args, matrix, date):
+    # pixel position of the Sun in a frame taken at date by a camera with the rotation matrix, None if it is off the sensor
+    azimuth, zenith = sunpos(date, latitude=args.latitude, longitude=args.longitude, elevation=args.elevation, columns=(0, 1))
+    projections, valid, inside = projectAzimuthZenith(args, azimuth, zenith, matrix)
+    if not (valid and inside):
+        return None
+    xInPixel, yInPixel = mm2Pixels(args, projections)
+    return int(xInPixel), int(yInPixel)
+
+def searchFrame(frame, args, prediction):
+    # look in the window around the prediction first, then over the whole frame at a stride of a third of the Sun
+    diameter = sunDiameterInPixel(args)
+    height, width = frame.shape[:2]
+    if prediction is not None:
+        half = args.window//2
+        x0, y0 = max(prediction[0] - half, 0), max(prediction[1] - half, 0)
+        x1, y1 = min(prediction[0] + half, width), min(prediction[1] + half, height)
+        if x0 < x1 and y0 < y1:
+            found = findSun(np.asarray(frame[y0:y1,x0:x1]), args.threshold, diameter)
+            if found is not None:
+                return x0 + found[0], y0 + found[1]
+    stride = max(int(diameter/3), 1)
+    coarse = findSun(np.asarray(frame[::stride,::stride]), args.threshold, diameter/stride)
+    if coarse is None:
+        return None
+    x, y = int(coarse[0]*stride), int(coarse[1]*stride)
+    half = int(diameter) + 2*stride
+    x0, y0 = max(x - half, 0), max(y - half, 0)
+    found = findSun(np.asarray(frame[y0:y + half,x0:x + half]), args.threshold, diameter)
+    if found is None:
+        return None
+    return x0 + found[0], y0 + found[1]
+
+def detectSequence(args, filenames, estimator=None):
+    # yields (filename, date, x, y) for every frame, x and y are None if the Sun wasn't found,
+    # observations are added to estimator, which predicts the window of the next frames once it has 2 of them
+    matrix = None
+    if args.camera_azimuth is not None and args.camera_pitch is not None and args.camera_roll is not None:
+        matrix = cameraMatrix(args.camera_azimuth, args.camera_pitch, args.camera_roll)
+    for filename in filenames:
+        date = frameTime(filename, args.time_format)
+        if estimator is not None and estimator.matrix is not None:
+            matrix = estimator.matrix
+        prediction = predictSun(args, matrix, date) if matrix is not None else None
+        frame = raster.openFrame(filename, "r", args.pixel_width, args.pixel_height)
+        found = searchFrame(frame, args, prediction)
+        del frame
+        if found is None:
+            yield filename, date, None, None
+            continue
+        if estimator is not None:
+            estimator.add(found[0], found[1], date)
+        yield filename, date, found[0], found[1]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.description = "find the Sun in a directory of frames named by their UTC capture time, print one [x in pixel, y in pixel, datetime] observation per line for orientation.py --stream, and the orientation solved from them"
+    parser.add_argument("frames", help="directory of uncompressed frames (binary PPM, .npy or raw RGB bytes)", type=str)
+    parser.add_argument("--time_format", default="%Y-%m-%d_%H-%M-%S", help="format of the UTC capture time in the file names, without the extension", type=str)
+    parser.add_argument("--threshold", default=250, help="brightness of the saturated Sun, 0-255", type=float)
+    parser.add_argument("--window", default=400, help="size in pixel of the window searched around the predicted Sun", type=int)
+
+    parser.add_argument("--latitude", help="latitude", type=float)
+    parser.add_argument("--longitude", help="longitude", type=float)
+    parser.add_argument("--elevation", default=0, help="elevation", type=float)
+    parser.add_argument("--camera_azimuth", help="approximate azimuth, to predict the Sun in the first frames", type=float)
+    parser.add_argument("--camera_pitch", help="approximate pitch", type=float)
+    parser.add_argument("--camera_roll", help="approximate roll", type=float)
+    parser.add_argument("--facing_back", default=True, help="camera facing back or not", type=lambda s: s == "True")
+    parser.add_argument("--focal_length", default=24, help="camera focal length in mm", type=float)
+    parser.add_argument("--sensor_width", default=36, help="camera sensor width in mm", type=float)
+    parser.add_argument("--sensor_height", default=24, help="camera sensor height in mm", type=float)
+    parser.add_argument("--pixel_width", default=5760, help="image width in pixel", type=int)
+    parser.add_argument("--pixel_height", default=3840, help="image height in pixel", type=int)
+    parser.add_argument("--half_life", help="seconds after which an observation counts for half, default is to never forget", type=float)
+
+    args = parser.parse_args()
+    if args.latitude == None or args.longitude == None:
+        parser.print_help()
+        sys.exit(-1)
+
+    filenames = sorted(os.path.join(args.frames, name) for name in os.listdir(args.frames) if name.lower().endswith(FRAME_EXTENSIONS))
+    estimator = OrientationEstimator(args, args.half_life)
+    for filename, date, x, y in detectSequence(args, filenames, estimator):
+        if x is None:
+            sys.stderr.write("no sun in %s\n" % filename)
+            continue
+        print json.dumps([round(x, 2), round(y, 2), date.strftime('%Y-%m-%d %H:%M:%S')])
+        sys.stdout.flush()
+    cameraAzimuth, cameraPitch, cameraRoll, matrix = estimator.orientation()
+    if matrix is None:
+        sys.stderr.write("less than 2 frames with the sun, no orientation\n")
+        sys.exit(-1)
+    sys.stderr.write("cameraAzimuth=%f cameraPitch=%f cameraRoll=%f\n" % (cameraAzimuth, cameraPitch, cameraRoll))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+#!/usr/bin/python
+
+# Fit the Sun's ephemeris with piecewise Chebyshev polynomials and save it for sunpos(..., ephemeris=FILENAME)
+
+from sunposition import fit_ephemeris, ephemeris_error
+import numpy as np
+import argparse
+import time
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.description = "fit the Sun's ephemeris with Chebyshev polynomials, sunpos can memory-map the saved file instead of evaluating the full algorithm"
+    parser.add_argument("--first_year", default=2000, help="first year covered by the fit", type=int)
+    parser.add_argument("--last_year", default=2050, help="last year covered by the fit", type=int)
+    parser.add_argument("--segment_days", default=8.0, help="length of each polynomial segment in days", type=float)
+    parser.add_argument("--degree", default=13, help="degree of the polynomial of each segment", type=int)
+    parser.add_argument("--samples", default=100000, help="number of random times to check the fit at", type=int)
+    parser.add_argument("--save", metavar="FILENAME", default="ephemeris.npy", help="save ephemeris", type=str)
+
+    args = parser.parse_args()
+    start = time.time()
+    records = fit_ephemeris(args.first_year, args.last_year, args.segment_days, args.degree)
+    np.save(args.save, records)
+    print "fitted %d segments in %f s, saved to %s" % (records.shape[0], time.time() - start, args.save)
+
+    alpha, delta, R, delta_psi, epsilon = ephemeris_error(records, args.samples)
+    print "max error against the full algorithm:"
+    print "right ascension=%g arcsec declination=%g arcsec" % (alpha*3600, delta*3600)
+    print "radius=%g AU nutation in longitude=%g arcsec obliquity=%g arcsec" % (R, delta_psi*3600, epsilon*3600)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+#!/usr/bin/python
+
+# Resolve the site's latitude&longitude for analemma.py without blocking startup:
+# answers are cached on disk, every lookup has a timeout and runs in a background thread, and the backend is pluggable
+#   "ipinfo"              look the public IP up on httpbin.org, then its location on ipinfo.io
+#   "http://host/path"    a service answering JSON like ipinfo.io, {"loc": "lat,lon"} or {"latitude": lat, "longitude": lon}
+#   "file:PATH"           a local JSON file in the same format, for tests and air-gapped nodes
+
+import json
+import os
+import threading
+import time
+
+CACHE = os.path.join(os.path.expanduser("~"), ".analemma_location.json")
+
+class LocationError(Exception):
+    pass
+
+def parseLocation(jsonContent):
+    if "loc" in jsonContent:
+        latitude,longitude = jsonContent["loc"].split(",")
+    else:
+        latitude,longitude = jsonContent["latitude"],jsonContent["longitude"]
+    return float(latitude),float(longitude)
+
+def getIPAddress(timeout):
+    import urllib2 # imported on use, it takes longer to import than the rest of the startup
+    response = urllib2.urlopen("http://httpbin.org/ip", timeout=timeout)
+    jsonContent = json.loads(response.read())
+    return jsonContent["origin"].split(",")[0]
+
+def ipinfoLocation(timeout):
+    deadline = time.time() + timeout
+    IP = getIPAddress(timeout)
+    return urlLocation("http://ipinfo.io/" + IP, max(deadline - time.time(), 0.001))
+
+def urlLocation(url, timeout):
+    import urllib2
+    response = urllib2.urlopen(url, timeout=timeout)
+    return parseLocation(json.loads(response.read()))
+
+def fileLocation(filename):
+    with open(filename) as f:
+        return parseLocation(json.load(f))
+
+def lookup(locator, timeout):
+    if locator == "ipinfo":
+        return ipinfoLocation(timeout)
+    if locator.startswith("file:"):
+        return fileLocation(locator[len("file:"):])
+    if locator.startswith(("http://", "https://")):
+        return urlLocation(locator, timeout)
+    raise LocationError("unknown locator %s" % locator)
+
+def readCache(cache, locator, max_age):
+    # a missing, truncated or hand-edited cache is a miss
+    try:
+        with open(cache) as f:
+            entry = json.load(f)[locator]
+        saved, latitude, longitude = float(entry["time"]), float(entry["latitude"]), float(entry["longitude"])
+    except (IOError, ValueError, KeyError, TypeError):
+        return None
+    if time.time() - saved > max_age:
+        return None
+    return latitude,longitude
+
+def writeCache(cache, locator, location):
+    try:
+        with open(cache) as f:
+            entries = json.load(f)
+    except (IOError, ValueError):
+        entries = {}
+    if not isinstance(entries, dict):
+        entries = {}
+    entries[locator] = {"latitude": location[0], "longitude": location[1], "time": time.time()}
+    try:
+        with open(cache, "w") as f:
+            json.dump(entries, f)
+    except (IOError, OSError):
+        pass
+
+class Resolver(object):
+    """Look the location up in a background thread, result() waits for it until timeout seconds after start()
+
+    cache is the JSON file of previous answers, None to always look up, max_age is in seconds
+    """
+    def __init__(self, locator="ipinfo", timeout=5.0, cache=CACHE, max_age=86400.0):
+        self.locator = locator
+        self.timeout = timeout
+        self.cache = cache
+        self.max_age = max_age
+        self._location = None
+        self._error = None
+        self._thread = None
+        self._deadline = None
+
+    def start(self):
+        if self.cache:
+            self._location = readCache(self.cache, self.locator, self.max_age)
+        if self._location is None and self._thread is None:
+            self._deadline = time.time() + self.timeout
+            self._thread = threading.Thread(target=self._run)
+            self._thread.daemon = True # never keep the process alive for a hung lookup
+            self._thread.start()
+        return self
+
+    def _run(self):
+        try:
+            location = lookup(self.locator, self.timeout)
+        except Exception as e:
+            self._error = e
+            return
+        if self.cache:
+            writeCache(self.cache, self.locator, location)
+        self._location = location
+
+    def result(self):
+        if self._location is None and self._thread is None:
+            self.start()
+        if self._thread is not None:
+            self._thread.join(max(self._deadline - time.time(), 0))
+            if self._thread.is_alive():
+                raise LocationError("%s didn't answer in %g s" % (self.locator, self.timeout))
+        if self._error is not None:
+            raise LocationError("%s failed: %s" % (self.locator, self._error))
+        return self._location
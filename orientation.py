@@ -2,13 +2,14 @@
 
 # Calculate DLSR's orientation based on position of Sun in photo and corresponding datetime.  
 # REF: https://www.geometrictools.com/Documentation/EulerAngles.pdf
+# The rotation is the least squares solution of Wahba's problem, from the SVD of the cross-covariance of the directions (Kabsch)
 
 from sunposition import sunpos
 from datetime import datetime
 import numpy as np
 import sys
 import json
-import argparse
+import csv
 import math
 
 # Coordinate System Transforms
@@ -42,58 +43,468 @@ def pixel2MM(xInPixel, yInPixel, pixel_width, pixel_height, sensor_width, sensor
     yInMM = -(1.0*yInPixel/pixel_height*sensor_height - sensor_height/2)
     return xInMM,yInMM
 
+def normalize(points):
+    # columns of points scaled to unit vectors
+    return points/np.sqrt(np.sum(points*points, axis=0))
+
+def getRotation(worldPoints, viewPoints, weights=None):
+    # rotation matrix R minimizing sum(weights*|viewPoint - R*worldPoint|^2) over the normalized columns of the 3xN arrays,
+    # it is U*diag(1,1,d)*V' from the SVD U*S*V' of the 3x3 cross-covariance sum(weights*viewPoint*worldPoint'),
+    # with d = det(U*V') keeping it a proper rotation, so the work is linear in the number of observations
+    worldDirections = normalize(worldPoints)
+    viewDirections = normalize(viewPoints)
+    if weights is not None:
+        viewDirections = viewDirections*weights
+    covariance = np.dot(viewDirections, worldDirections.T)
+    return covariance2Rotation(covariance)
+
+def covariance2Rotation(covariance):
+    # covariance is 3x3 or a stack (...,3,3) of them
+    U, S, Vt = np.linalg.svd(covariance)
+    d = np.sign(np.linalg.det(np.matmul(U, Vt)))
+    U = U.copy()
+    U[...,2] *= d[...,None]
+    return np.matmul(U, Vt)
+
+def rotation2Orientation(matrix):
+    # inverse of worldPoint2ViewPoint's matrix = Ry*Rx*Rz, see worldPoint2ViewPoint_matrix.txt
+    if matrix[1,2] < 1.0:
+        if matrix[1,2] > -1.0:
+            cameraPitch = math.asin(-matrix[1,2])/math.pi*180.0
+            cameraRoll = math.atan2(matrix[0,2], matrix[2,2])/math.pi*180.0
+            cameraAzimuth = math.atan2(matrix[1,0], matrix[1,1])/math.pi*180.0
+        else:
+            cameraPitch = 90.0
+            cameraRoll = 0.0
+            cameraAzimuth = math.atan2(-matrix[0,1], matrix[0,0])/math.pi*180.0
+    else:
+        cameraPitch = -90.0
+        cameraRoll = 0.0
+        cameraAzimuth = math.atan2(-matrix[0,1], matrix[0,0])/math.pi*180.0
+    return cameraAzimuth, cameraPitch, cameraRoll
+
+def getResiduals(matrix, worldPoints, viewPoints):
+    # angle in degrees between each observed direction and the direction the rotation predicts for it
+    predicted = np.dot(matrix, normalize(worldPoints))
+    observed = normalize(viewPoints)
+    cross = np.sqrt(np.sum(np.cross(predicted, observed, axis=0)**2, axis=0))
+    return np.rad2deg(np.arctan2(cross, np.sum(predicted*observed, axis=0)))
+
 def getOrientation(worldPoints, viewPoints):
-    count = 0
-    total = worldPoints.shape[1]/3*3
-    cameraAzimuthSum = 0.0
-    cameraPitchSum = 0.0
-    cameraRollSum = 0.0
-    for i in range(total):
-        worldPointArray = worldPoints[:,:(i+1)*3]
-        viewPointArray = viewPoints[:,:(i+1)*3]
-        matrix = np.dot(viewPointArray, np.linalg.inv(worldPointArray))
-        if matrix[1,2] < 1.0:
-            if matrix[1,2] > -1.0:
-                cameraPitch = math.asin(-matrix[1,2])/math.pi*180.0
-                cameraRoll = math.atan2(matrix[0,2], matrix[2,2])/math.pi*180.0
-                cameraAzimuth = math.atan2(matrix[1,0], matrix[1,1])/math.pi*180.0
+    # returns azimuth, pitch, roll, the rotation matrix and the residual of every observation in degrees,
+    # Nones if there are less than 2 observations, a single direction doesn't fix the rotation
+    if worldPoints.shape[1] < 2:
+        return None, None, None, None, None
+    matrix = getRotation(worldPoints, viewPoints)
+    cameraAzimuth, cameraPitch, cameraRoll = rotation2Orientation(matrix)
+    return cameraAzimuth, cameraPitch, cameraRoll, matrix, getResiduals(matrix, worldPoints, viewPoints)
+
+def getPoints(args, datalist):
+    # 3xN arrays of the sun's world points and of the view points it was photographed at
+    dates = [datetime.strptime(data[2], '%Y-%m-%d %H:%M:%S') for data in datalist]
+    positions = sunpos(dates, latitude=args.latitude, longitude=args.longitude, elevation=args.elevation, columns=(0, 1))
+    worldPoints = np.empty(shape=[3, len(datalist)])
+    viewPoints = np.empty(shape=[3, len(datalist)])
+    for i in range(len(datalist)):
+        xInPixel = datalist[i][0]
+        yInPixel = datalist[i][1]
+        worldPoints[:,i:i+1] = worldAzimuthZenith2WorldPoint(positions[i,0], positions[i,1])
+        xInMM, yInMM = pixel2MM(xInPixel, yInPixel, args.pixel_width, args.pixel_height, args.sensor_width, args.sensor_height)
+        viewPoints[:,i:i+1] = projection2ViewPoint(xInMM, yInMM, args.focal_length, args.sensor_width, args.sensor_height, args.facing_back)
+    return worldPoints, viewPoints
+
+def getRobustOrientation(worldPoints, viewPoints, threshold=0.2, confidence=0.999, max_iterations=10000, batch=64, seed=0):
+    # RANSAC: rotations are fitted to random pairs of observations, a batch of them at a time, and every rotation of the batch
+    # is scored against every observation at once, the inliers are the observations within threshold degrees.
+    # Sampling stops once a rotation fitted to inliers only was drawn with the given confidence, the best consensus set
+    # is then refined with getRotation until it doesn't change.
+    # returns azimuth, pitch, roll, the rotation matrix, the residuals in degrees and the inlier mask, or Nones
+    n = worldPoints.shape[1]
+    if n < 2:
+        return None, None, None, None, None, None
+    worldDirections = normalize(worldPoints)
+    viewDirections = normalize(viewPoints)
+    cosThreshold = math.cos(math.radians(threshold))
+    random = np.random.RandomState(seed)
+    best = None
+    bestCount = 0
+    needed = max_iterations
+    iterations = 0
+    while iterations < min(needed, max_iterations):
+        # batch x 2 distinct observations
+        first = random.randint(0, n, batch)
+        second = (first + random.randint(1, n, batch)) % n
+        covariances = np.einsum('ik,jk->kij', viewDirections[:,first], worldDirections[:,first]) + \
+                      np.einsum('ik,jk->kij', viewDirections[:,second], worldDirections[:,second])
+        rotations = covariance2Rotation(covariances)
+        # cosine of the angle between every predicted and observed direction, batch x n
+        cosines = np.einsum('kij,jn,in->kn', rotations, worldDirections, viewDirections)
+        counts = np.count_nonzero(cosines >= cosThreshold, axis=1)
+        k = np.argmax(counts)
+        if counts[k] > bestCount:
+            bestCount = counts[k]
+            best = cosines[k] >= cosThreshold
+            ratio = 1.0*bestCount/n
+            if ratio >= 1.0:
+                needed = 0
             else:
-                continue
-                # cameraPitch = 90.0
-                # cameraRoll = 0.0
-                # cameraAzimuth = math.atan2(-matrix[0,1], matrix[0,0])/math.pi*180.0
+                needed = int(math.ceil(math.log(1 - confidence)/math.log(1 - ratio*ratio)))
+        iterations += batch
+    if bestCount < 2:
+        return None, None, None, None, None, None
+    inliers = best
+    for i in range(10):
+        matrix = getRotation(worldDirections[:,inliers], viewDirections[:,inliers])
+        residuals = getResiduals(matrix, worldDirections, viewDirections)
+        refined = residuals <= threshold
+        if np.count_nonzero(refined) < 2 or np.array_equal(refined, inliers):
+            break
+        inliers = refined
+    cameraAzimuth, cameraPitch, cameraRoll = rotation2Orientation(matrix)
+    return cameraAzimuth, cameraPitch, cameraRoll, matrix, residuals, inliers
+
+# Joint calibration: the orientation, the effective focal length and the offset of the principal point (where the optical axis
+# meets the sensor, in mm from its center) are refined together by Levenberg-Marquardt on the reprojection error in mm
+
+def rotationVector2Matrix(delta):
+    # Rodrigues' formula, rotation by |delta| radians about delta
+    angle = np.sqrt(np.dot(delta, delta))
+    if angle < 1e-12:
+        return np.eye(3)
+    k = delta/angle
+    K = np.array([[0, -k[2], k[1]], [k[2], 0, -k[0]], [-k[1], k[0], 0]])
+    return np.eye(3) + math.sin(angle)*K + (1 - math.cos(angle))*np.dot(K, K)
+
+def project(matrix, worldDirections, focal_length, principalPoint, facing_back):
+    # projections in mm (2xN) of the world directions, with their view directions (3xN)
+    viewDirections = np.dot(matrix, worldDirections)
+    depth = -viewDirections[2] if facing_back == True else viewDirections[2]
+    projections = focal_length*viewDirections[:2]/depth + np.reshape(principalPoint, (2, 1))
+    return projections, viewDirections
+
+def projectionJacobian(viewDirections, focal_length, facing_back):
+    # analytic Jacobian (N,2,6) of the projections with respect to a small rotation delta applied after the matrix
+    # (R = rotationVector2Matrix(delta)*matrix), the focal length and the principal point
+    sign = -1.0 if facing_back == True else 1.0
+    x, y, z = viewDirections
+    depth = sign*z
+    n = viewDirections.shape[1]
+    # d(projection)/d(viewDirection), (N,2,3)
+    dp = np.zeros((n, 2, 3))
+    dp[:,0,0] = focal_length/depth
+    dp[:,0,2] = -focal_length*x*sign/depth**2
+    dp[:,1,1] = focal_length/depth
+    dp[:,1,2] = -focal_length*y*sign/depth**2
+    # d(viewDirection)/d(delta) = -[viewDirection]x, (N,3,3)
+    dv = np.zeros((n, 3, 3))
+    dv[:,0,1] = z
+    dv[:,0,2] = -y
+    dv[:,1,0] = -z
+    dv[:,1,2] = x
+    dv[:,2,0] = y
+    dv[:,2,1] = -x
+    J = np.zeros((n, 2, 6))
+    J[:,:,:3] = np.einsum('nij,njk->nik', dp, dv)
+    J[:,0,3] = x/depth
+    J[:,1,3] = y/depth
+    J[:,0,4] = 1.0
+    J[:,1,5] = 1.0
+    return J
+
+def orientationJacobian(matrix):
+    # analytic Jacobian (3,3) of rotation2Orientation's azimuth, pitch, roll in degrees with respect to a small rotation
+    # delta applied after the matrix, as in projectionJacobian, d(matrix)/d(delta_k) = [e_k]x*matrix
+    dR = np.array([np.cross(np.eye(3)[k], matrix, axisb=0, axisc=0) for k in range(3)])
+    G = np.zeros((3, 3))
+    if abs(matrix[1,2]) < 1.0:
+        G[0] = (matrix[1,1]*dR[:,1,0] - matrix[1,0]*dR[:,1,1])/(matrix[1,0]**2 + matrix[1,1]**2)
+        G[1] = -dR[:,1,2]/math.sqrt(1 - matrix[1,2]**2)
+        G[2] = (matrix[2,2]*dR[:,0,2] - matrix[0,2]*dR[:,2,2])/(matrix[0,2]**2 + matrix[2,2]**2)
+    else:
+        # gimbal lock, pitch and roll are pinned and only the azimuth moves
+        G[0] = (-matrix[0,0]*dR[:,0,1] + matrix[0,1]*dR[:,0,0])/(matrix[0,0]**2 + matrix[0,1]**2)
+    return np.rad2deg(G)
+
+def calibrate(worldPoints, xInMM, yInMM, focal_length, facing_back, iterations=100, tolerance=1e-12):
+    # refine the orientation, focal length and principal point offset to fit the observed projections in mm,
+    # starting from the SVD solution with the nominal focal length and a centered principal point
+    # returns azimuth, pitch, roll, the rotation matrix, focal length in mm, principal point offset in mm (x, y),
+    # the residual of every observation in mm, and the 6x6 covariance of (azimuth, pitch, roll in degrees,
+    # focal length, principal point x, y in mm), or Nones if there are less than 4 observations
+    n = worldPoints.shape[1]
+    if n < 4:
+        return None, None, None, None, None, None, None, None
+    worldDirections = normalize(worldPoints)
+    observed = np.vstack([xInMM, yInMM]).astype(float)
+    sign = -1.0 if facing_back == True else 1.0
+    viewDirections = normalize(np.vstack([observed/focal_length, sign*np.ones(n)]))
+    matrix = getRotation(worldDirections, viewDirections)
+    principalPoint = np.zeros(2)
+
+    def cost(matrix, focal_length, principalPoint):
+        projections, views = project(matrix, worldDirections, focal_length, principalPoint, facing_back)
+        errors = projections - observed
+        return np.sum(errors*errors), errors, views
+
+    current, errors, views = cost(matrix, focal_length, principalPoint)
+    damping = 1e-3
+    for i in range(iterations):
+        J = projectionJacobian(views, focal_length, facing_back).reshape(2*n, 6)
+        r = errors.T.reshape(2*n)
+        JtJ = np.dot(J.T, J)
+        Jtr = np.dot(J.T, r)
+        improved = False
+        while damping < 1e12:
+            step = np.linalg.solve(JtJ + damping*np.diag(np.diag(JtJ)), -Jtr)
+            candidate = (np.dot(rotationVector2Matrix(step[:3]), matrix), focal_length + step[3], principalPoint + step[4:])
+            trial, trialErrors, trialViews = cost(*candidate)
+            if trial < current:
+                matrix, focal_length, principalPoint = candidate
+                done = current - trial <= tolerance*current or np.max(np.abs(step)) < tolerance
+                current, errors, views = trial, trialErrors, trialViews
+                damping = max(damping/10, 1e-12)
+                improved = True
+                break
+            damping *= 10
+        if not improved or done:
+            break
+
+    # covariance of (delta, focal length, principal point) from the final Jacobian, then of the Euler angles
+    # through the Jacobian of rotation2Orientation
+    J = projectionJacobian(views, focal_length, facing_back).reshape(2*n, 6)
+    variance = current/max(2*n - 6, 1)
+    covariance = variance*np.linalg.pinv(np.dot(J.T, J))
+    cameraAzimuth, cameraPitch, cameraRoll = rotation2Orientation(matrix)
+    G = np.eye(6)
+    G[:3,:3] = orientationJacobian(matrix)
+    covariance = np.dot(G, np.dot(covariance, G.T))
+    residuals = np.sqrt(np.sum(errors*errors, axis=0))
+    return cameraAzimuth, cameraPitch, cameraRoll, matrix, focal_length, principalPoint, residuals, covariance
+
+class OrientationEstimator(object):
+    """Refine the orientation as observations arrive, one at a time
+
+    Only the weighted 3x3 cross-covariance of the sun's world and view directions is kept, so each update takes
+    constant time and memory. args holds the site and camera like the command line options. half_life in seconds
+    makes older observations count for less, so a bumped tripod is forgotten; None keeps them all at full weight.
+    """
+    def __init__(self, args, half_life=None):
+        self.args = args
+        self.half_life = half_life
+        self.reset()
+
+    def reset(self):
+        self.covariance = np.zeros((3, 3))
+        self.weight = 0.0 # effective number of observations after forgetting
+        self.count = 0
+        self.date = None
+        self.matrix = None
+
+    def add(self, xInPixel, yInPixel, date):
+        # returns the residual in degrees of the observation against the orientation before it, None for the first 2
+        args = self.args
+        azimuth, zenith = sunpos(date, latitude=args.latitude, longitude=args.longitude, elevation=args.elevation, columns=(0, 1))
+        worldDirection = normalize(worldAzimuthZenith2WorldPoint(azimuth, zenith))
+        xInMM, yInMM = pixel2MM(xInPixel, yInPixel, args.pixel_width, args.pixel_height, args.sensor_width, args.sensor_height)
+        viewDirection = normalize(projection2ViewPoint(xInMM, yInMM, args.focal_length, args.sensor_width, args.sensor_height, args.facing_back))
+        residual = None
+        if self.matrix is not None:
+            residual = getResiduals(self.matrix, worldDirection, viewDirection)[0]
+        if self.half_life and self.date is not None and date > self.date:
+            decay = 0.5**((date - self.date).total_seconds()/self.half_life)
+            self.covariance *= decay
+            self.weight *= decay
+        if self.date is None or date > self.date:
+            self.date = date
+        self.covariance += np.dot(viewDirection, worldDirection.T)
+        self.weight += 1.0
+        self.count += 1
+        if self.count >= 2:
+            self.matrix = covariance2Rotation(self.covariance)
+        return residual
+
+    def orientation(self):
+        # azimuth, pitch, roll and the rotation matrix, Nones before 2 observations
+        if self.matrix is None:
+            return None, None, None, None
+        return rotation2Orientation(self.matrix) + (self.matrix,)
+
+# Batch solving: a table has one row per observation, with the columns camera_id, x, y (in pixel) and datetime,
+# and optionally the columns of TABLE_PARAMETERS, which default to the command line options
+
+TABLE_COLUMNS = ["camera_id", "x", "y", "datetime"]
+TABLE_PARAMETERS = ["latitude", "longitude", "elevation", "focal_length", "sensor_width", "sensor_height", "pixel_width", "pixel_height", "facing_back"]
+RESULT_COLUMNS = ["camera_id", "observations", "azimuth", "pitch", "roll", "rms_residual", "max_residual"]
+
+def readTable(filename):
+    # CSV with a header row, or a JSON list of objects
+    with open(filename) as f:
+        if filename.lower().endswith(".json"):
+            return json.load(f)
+        return list(csv.DictReader(f))
+
+def writeTable(f, results):
+    writer = csv.writer(f)
+    writer.writerow(RESULT_COLUMNS)
+    for result in results:
+        writer.writerow([result[column] for column in RESULT_COLUMNS])
+
+def rotations2Orientations(matrices):
+    # rotation2Orientation of a stack (K,3,3) of matrices, returns arrays of azimuth, pitch, roll
+    m = matrices
+    lock = np.abs(m[:,1,2]) >= 1.0
+    cameraPitch = np.where(lock, -90.0*np.sign(m[:,1,2]), np.rad2deg(np.arcsin(np.clip(-m[:,1,2], -1.0, 1.0))))
+    cameraRoll = np.where(lock, 0.0, np.rad2deg(np.arctan2(m[:,0,2], m[:,2,2])))
+    cameraAzimuth = np.where(lock, np.rad2deg(np.arctan2(-m[:,0,1], m[:,0,0])), np.rad2deg(np.arctan2(m[:,1,0], m[:,1,1])))
+    return cameraAzimuth, cameraPitch, cameraRoll
+
+def isBlank(value):
+    return value is None or (isinstance(value, basestring) and value == "")
+
+def parseBool(value):
+    # booleans of JSON rows and the cells of CSV rows, None if value isn't one of the usual spellings
+    if isinstance(value, basestring):
+        value = value.strip().lower()
+        if value in ("true", "yes", "1"):
+            return True
+        if value in ("false", "no", "0"):
+            return False
+        return None
+    if value in (True, False):
+        return bool(value)
+    return None
+
+def checkTable(rows, args):
+    # the rows that have every column or a command line default for it, and (row index, message) of the others
+    defaults = [key for key in TABLE_PARAMETERS if getattr(args, key, None) is not None]
+    required = TABLE_COLUMNS + [key for key in TABLE_PARAMETERS if key not in defaults]
+    valid = []
+    failures = []
+    for index, row in enumerate(rows):
+        missing = [key for key in required if isBlank(row.get(key))]
+        if missing:
+            failures.append((index, "missing %s" % ", ".join(missing)))
+        elif not isBlank(row.get("facing_back")) and parseBool(row["facing_back"]) is None:
+            failures.append((index, "facing_back is %r, not true or false" % row["facing_back"]))
         else:
-            continue
-            # cameraPitch = -90.0
-            # cameraRoll = 0
-            # cameraAzimuth = math.atan2(-matrix[0,1], matrix[0,0])/math.pi*180.0
-        cameraAzimuthSum += cameraAzimuth
-        cameraPitchSum += cameraPitch
-        cameraRollSum += cameraRoll
-        count += 1
-    if count == 0:
-        return None, None, None
-    return cameraAzimuthSum/count, cameraPitchSum/count, cameraRollSum/count
+            valid.append(row)
+    return valid, failures
+
+def solveTable(rows, args):
+    # one result per camera, in order of first appearance, every sun position is computed in one sunpos call
+    # (shared by the rows of the same site and time) and every camera's rotation by one stacked SVD
+    # returns the results and (row index, message) of the rows that were left out
+    rows, failures = checkTable(rows, args)
+    if not rows:
+        return [], failures
+    def column(key, type=float):
+        default = getattr(args, key, None)
+        values = [row.get(key) for row in rows]
+        return np.array([default if isBlank(value) else type(value) for value in values])
+    cameraIds = [str(row["camera_id"]) for row in rows]
+    order = []
+    cameraIndex = {}
+    for cameraId in cameraIds:
+        if cameraId not in cameraIndex:
+            cameraIndex[cameraId] = len(order)
+            order.append(cameraId)
+    camera = np.array([cameraIndex[cameraId] for cameraId in cameraIds], dtype=int)
+    K = len(order)
+
+    # sun positions of the distinct (datetime, site)
+    parsed = {}
+    for row in rows:
+        if row["datetime"] not in parsed:
+            parsed[row["datetime"]] = datetime.strptime(str(row["datetime"]), '%Y-%m-%d %H:%M:%S')
+    dates = [parsed[row["datetime"]] for row in rows]
+    latitude, longitude, elevation = column("latitude"), column("longitude"), column("elevation")
+    keys = list(zip(dates, latitude, longitude, elevation))
+    unique = {}
+    for key in keys:
+        unique.setdefault(key, len(unique))
+    sites = sorted(unique, key=unique.get)
+    inverse = np.array([unique[key] for key in keys], dtype=int)
+    positions = sunpos([site[0] for site in sites], [site[1] for site in sites], [site[2] for site in sites], [site[3] for site in sites], columns=(0, 1))
+    azimuth = np.deg2rad(positions[inverse,0])
+    zenith = np.deg2rad(positions[inverse,1])
+    worldDirections = np.vstack([np.sin(zenith)*np.sin(azimuth), np.sin(zenith)*np.cos(azimuth), np.cos(zenith)])
+
+    # directions the sun was photographed at, as projection2ViewPoint
+    focal_length = column("focal_length")
+    sensor_width, sensor_height = column("sensor_width"), column("sensor_height")
+    xInMM = column("x")/column("pixel_width")*sensor_width - sensor_width/2
+    yInMM = -(column("y")/column("pixel_height")*sensor_height - sensor_height/2)
+    facing_back = column("facing_back", parseBool)
+    sign = np.where(facing_back, -1.0, 1.0)
+    viewDirections = normalize(np.vstack([xInMM/focal_length, yInMM/focal_length, sign]))
+
+    # stacked cross-covariances and rotations
+    outer = np.einsum('in,jn->nij', viewDirections, worldDirections).reshape(-1, 9)
+    covariances = np.array([np.bincount(camera, weights=outer[:,i], minlength=K) for i in range(9)]).T.reshape(K, 3, 3)
+    counts = np.bincount(camera, minlength=K)
+    matrices = covariance2Rotation(covariances)
+    cameraAzimuth, cameraPitch, cameraRoll = rotations2Orientations(matrices)
+
+    predicted = np.einsum('nij,jn->in', matrices[camera], worldDirections)
+    cross = np.sqrt(np.sum(np.cross(predicted, viewDirections, axis=0)**2, axis=0))
+    residuals = np.rad2deg(np.arctan2(cross, np.sum(predicted*viewDirections, axis=0)))
+    rms = np.sqrt(np.bincount(camera, weights=residuals**2, minlength=K)/counts)
+    worst = np.zeros(K)
+    np.maximum.at(worst, camera, residuals)
+
+    results = []
+    for k in range(K):
+        solved = counts[k] >= 2
+        results.append({"camera_id": order[k], "observations": counts[k],
+                        "azimuth": cameraAzimuth[k] if solved else None, "pitch": cameraPitch[k] if solved else None,
+                        "roll": cameraRoll[k] if solved else None, "rms_residual": rms[k] if solved else None,
+                        "max_residual": worst[k] if solved else None})
+    return results, failures
 
 def solve(args):
     datalist = json.loads(args.data)
-    worldPoints = np.empty(shape=[3, 0])
-    viewPoints = np.empty(shape=[3, 0])
-    for i in range(len(datalist)):
-        data = datalist[i]
-        xInPixel = data[0]
-        yInPixel = data[1]
-        date = datetime.strptime(data[2], '%Y-%m-%d %H:%M:%S')
-        azimuth, zenith = sunpos(date, latitude=args.latitude, longitude=args.longitude, elevation=args.elevation)[:2]
-        worldPoint = worldAzimuthZenith2WorldPoint(azimuth, zenith)
-        xInMM, yInMM = pixel2MM(xInPixel, yInPixel, args.pixel_width, args.pixel_height, args.sensor_width, args.sensor_height)
-        viewPoint = projection2ViewPoint(xInMM, yInMM, args.focal_length, args.sensor_width, args.sensor_height, args.facing_back)
-        worldPoints = np.append(worldPoints, worldPoint, 1)
-        viewPoints = np.append(viewPoints, viewPoint, 1)
-    cameraAzimuth, cameraPitch, cameraRoll = getOrientation(worldPoints, viewPoints)
-    return cameraAzimuth,cameraPitch, cameraRoll
+    worldPoints, viewPoints = getPoints(args, datalist)
+    if args.ransac:
+        return getRobustOrientation(worldPoints, viewPoints, args.ransac, seed=args.seed)
+    return getOrientation(worldPoints, viewPoints) + (None,)
+
+def solveCalibration(args):
+    datalist = json.loads(args.data)
+    worldPoints, viewPoints = getPoints(args, datalist)
+    xInMM, yInMM = pixel2MM(np.array([data[0] for data in datalist]), np.array([data[1] for data in datalist]), args.pixel_width, args.pixel_height, args.sensor_width, args.sensor_height)
+    cameraAzimuth, cameraPitch, cameraRoll, matrix, focal_length, principalPoint, residuals, covariance = calibrate(worldPoints, xInMM, yInMM, args.focal_length, args.facing_back)
+    if matrix is None:
+        print "at least 4 observations are needed to calibrate"
+        sys.exit(-1)
+    sd = np.sqrt(np.diag(covariance))
+    xInPixel = principalPoint[0]/args.sensor_width*args.pixel_width
+    yInPixel = -principalPoint[1]/args.sensor_height*args.pixel_height
+    print "cameraAzimuth=%f+-%f cameraPitch=%f+-%f cameraRoll=%f+-%f" % (cameraAzimuth, sd[0], cameraPitch, sd[1], cameraRoll, sd[2])
+    print "focal_length=%f+-%f mm" % (focal_length, sd[3])
+    print "principal point offset x=%f+-%f mm (%f pixel) y=%f+-%f mm (%f pixel)" % (principalPoint[0], sd[4], xInPixel, principalPoint[1], sd[5], yInPixel)
+    print "covariance of azimuth, pitch, roll (degree), focal_length, x, y (mm):"
+    print covariance
+    for i in range(len(residuals)):
+        print "observation %d residual=%f mm (%f pixel)" % (i, residuals[i], residuals[i]/args.sensor_width*args.pixel_width)
+
+def stream(args):
+    estimator = OrientationEstimator(args, args.half_life)
+    for line in iter(sys.stdin.readline, ""):
+        if not line.strip():
+            continue
+        data = json.loads(line)
+        residual = estimator.add(data[0], data[1], datetime.strptime(data[2], '%Y-%m-%d %H:%M:%S'))
+        cameraAzimuth, cameraPitch, cameraRoll, matrix = estimator.orientation()
+        if matrix is None:
+            print "observation %d" % (estimator.count - 1)
+        elif residual is None:
+            print "observation %d cameraAzimuth=%f cameraPitch=%f cameraRoll=%f" % (estimator.count - 1, cameraAzimuth, cameraPitch, cameraRoll)
+        else:
+            print "observation %d residual=%f degree cameraAzimuth=%f cameraPitch=%f cameraRoll=%f" % (estimator.count - 1, residual, cameraAzimuth, cameraPitch, cameraRoll)
+        sys.stdout.flush()
 
 def main():
+    import argparse # imported on use, only the command line needs it
     parser = argparse.ArgumentParser()
     parser.description = "solve DSLR's azimuth, pitch and roll"
     parser.add_argument("--latitude", help="latitude", type=float)
@@ -109,13 +520,44 @@ def main():
     parser.add_argument("--pixel_width", default=5760, help="image width in pixel", type=int)
     parser.add_argument("--pixel_height", default=3840, help="image height in pixel", type=int)
 
+    parser.add_argument("--ransac", metavar="THRESHOLD", help="ignore outliers, observations more than THRESHOLD degrees away from the best consensus", type=float)
+    parser.add_argument("--seed", default=0, help="random seed of --ransac", type=int)
+    parser.add_argument("--calibrate", action="store_true", help="also refine the focal length and the principal point, needs at least 4 observations")
+
+    parser.add_argument("--table", metavar="FILENAME", help="solve many cameras at once from a CSV or JSON table of observations with the columns camera_id, x, y, datetime and optionally latitude, longitude, elevation and the camera options")
+    parser.add_argument("--output", metavar="FILENAME", help="CSV file of the --table results, one row per camera, default is stdout", type=str)
+    parser.add_argument("--stream", action="store_true", help="read observations [x in pixel, y in pixel, datetime] from stdin, one per line, and print the orientation after each")
+    parser.add_argument("--half_life", help="seconds after which an observation counts for half in --stream mode, default is to never forget", type=float)
+
     args = parser.parse_args()
+    if args.table:
+        results, failures = solveTable(readTable(args.table), args)
+        for index, error in failures:
+            sys.stderr.write("row %d left out: %s\n" % (index, error))
+        if args.output:
+            with open(args.output, "wb") as f:
+                writeTable(f, results)
+        else:
+            writeTable(sys.stdout, results)
+        return
+    if args.stream:
+        stream(args)
+        return
     if args.data == None:
         parser.print_help()
         sys.exit(-1)
+    if args.calibrate:
+        solveCalibration(args)
+        return
 
-    cameraAzimuth, cameraPitch, cameraRoll = solve(args)
+    cameraAzimuth, cameraPitch, cameraRoll, matrix, residuals, inliers = solve(args)
+    if matrix is None:
+        print "at least 2 consistent observations are needed"
+        sys.exit(-1)
     print "cameraAzimuth=%f cameraPitch=%f cameraRoll=%f" % (cameraAzimuth,cameraPitch, cameraRoll)
+    for i in range(len(residuals)):
+        outlier = " outlier" if inliers is not None and not inliers[i] else ""
+        print "observation %d residual=%f degree%s" % (i, residuals[i], outlier)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,124 @@
+#!/usr/bin/python
+
+# Draw anti-aliased disks straight into a numpy RGBA image at the sensor's resolution and save it as PNG, without matplotlib
+# Frames of photos are memory-mapped, so only the tiles around the disks are read and written
+
+import numpy as np
+import shutil
+import struct
+import zlib
+
+def hex2RGB(color):
+    color = color.lstrip("#")
+    return [int(color[i:i+2], 16) for i in (0, 2, 4)]
+
+def newImage(width, height):
+    # transparent RGBA image, rows from top to bottom
+    return np.zeros((height, width, 4), dtype=np.uint8)
+
+def drawDisks(image, xs, ys, diameter, colors):
+    # image is (height, width) gray, (height, width, 3) RGB or (height, width, 4) RGBA uint8
+    # xs,ys are the centers in pixel, (0,0) is the top left corner of the image and pixel (i,j) covers [i,i+1)x[j,j+1)
+    # the coverage of each pixel is approximated by the distance of its center to the edge of the disk,
+    # disks are composited over the image in order, an RGB or gray image is opaque and gets the luma of the colors
+    height, width = image.shape[:2]
+    pixels = image[...,None] if image.ndim == 2 else image
+    channels = pixels.shape[2]
+    radius = diameter/2.0
+    reach = int(np.ceil(radius + 0.5))
+    for x, y, color in zip(xs, ys, colors):
+        left, top = int(np.floor(x)) - reach, int(np.floor(y)) - reach
+        x0, x1 = max(left, 0), min(left + 2*reach + 1, width)
+        y0, y1 = max(top, 0), min(top + 2*reach + 1, height)
+        if x0 >= x1 or y0 >= y1:
+            continue
+        dx = np.arange(left, left + 2*reach + 1) + 0.5 - x
+        dy = np.arange(top, top + 2*reach + 1) + 0.5 - y
+        distance = np.sqrt(dx[None,:]**2 + dy[:,None]**2)
+        coverage = np.clip(radius + 0.5 - distance, 0.0, 1.0)
+        if radius < 1.0:
+            # the approximation is poor for disks about a pixel wide, they are scaled to their exact area (before the
+            # image's edges cut them) so that they neither vanish nor grow with where their center falls in a pixel
+            total = coverage.sum()
+            if total > 0:
+                coverage = np.minimum(coverage*(np.pi*radius*radius/total), 1.0)
+        coverage = coverage[y0 - top:y1 - top,x0 - left:x1 - left]
+        box = pixels[y0:y1,x0:x1].astype(np.float32)/255
+        alpha = box[...,3] if channels == 4 else np.ones(box.shape[:2], dtype=np.float32)
+        outAlpha = coverage + alpha*(1 - coverage)
+        rgb = np.array(hex2RGB(color), dtype=np.float32)/255
+        if channels == 1:
+            rgb = np.dot(rgb, [0.299, 0.587, 0.114])[None]
+        colorChannels = min(channels, 3)
+        box[...,:colorChannels] = (rgb*coverage[...,None] + box[...,:colorChannels]*(alpha*(1 - coverage))[...,None])/np.where(outAlpha > 0, outAlpha, 1)[...,None]
+        if channels == 4:
+            box[...,3] = outAlpha
+        pixels[y0:y1,x0:x1] = np.round(box*255).astype(np.uint8)
+    return image
+
+def writePNG(filename, image, level=1, rows=256):
+    # image is (height, width) gray, (height, width, 3) RGB or (height, width, 4) RGBA uint8
+    # it is compressed a band of rows at a time, so a memory-mapped frame is never read into memory whole
+    height, width = image.shape[:2]
+    channels = 1 if image.ndim == 2 else image.shape[2]
+    colorType = {1: 0, 3: 2, 4: 6}[channels]
+    def chunk(tag, data):
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xffffffff)
+    with open(filename, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        f.write(chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, colorType, 0, 0, 0)))
+        compressor = zlib.compressobj(level)
+        raw = np.zeros((rows, 1 + width*channels), dtype=np.uint8) # filter type 0 on every row
+        for start in range(0, height, rows):
+            band = image[start:start+rows]
+            raw[:len(band),1:] = band.reshape(len(band), width*channels)
+            data = compressor.compress(raw[:len(band)].tobytes())
+            if data:
+                f.write(chunk(b"IDAT", data))
+        f.write(chunk(b"IDAT", compressor.flush()))
+        f.write(chunk(b"IEND", b""))
+
+# Uncompressed RGB frames: binary PPM (P6, 8 bit), numpy .npy arrays, or raw RGB bytes of a known size
+
+def readPNMHeader(f):
+    fields = []
+    while len(fields) < 4:
+        line = f.readline()
+        if not line:
+            raise ValueError("truncated PPM header")
+        fields += line.split(b"#")[0].split()
+    magic, width, height, maxval = fields[0], int(fields[1]), int(fields[2]), int(fields[3])
+    if magic != b"P6" or maxval != 255:
+        raise ValueError("only 8 bit binary PPM is supported")
+    return (height, width, 3)
+
+def openFrame(filename, mode="r", width=None, height=None):
+    # memory-map a frame as an (height, width, channels) uint8 array, mode is "r", "r+" or "c" (copy-on-write),
+    # .npy frames may also be (height, width) gray
+    if filename.lower().endswith(".npy"):
+        frame = np.load(filename, mmap_mode=mode)
+        if frame.dtype != np.uint8 or not (frame.ndim == 2 or (frame.ndim == 3 and frame.shape[2] in (3, 4))):
+            raise ValueError("%s is a %s array of shape %s, not an 8 bit gray, RGB or RGBA frame" % (filename, frame.dtype, frame.shape))
+        return frame
+    if filename.lower().endswith((".ppm", ".pnm")):
+        with open(filename, "rb") as f:
+            shape = readPNMHeader(f)
+            offset = f.tell()
+        return np.memmap(filename, dtype=np.uint8, mode=mode, offset=offset, shape=shape)
+    if width is None or height is None:
+        raise ValueError("the size of the raw frame %s is needed" % filename)
+    return np.memmap(filename, dtype=np.uint8, mode=mode, shape=(height, width, 3))
+
+def overlay(source, output, xs, ys, diameter, colors, width=None, height=None):
+    # composite the disks onto a copy of the frame in source, output has the same format as source unless it is a PNG,
+    # the frame is memory-mapped and only the tiles around the disks are touched
+    if output.lower().endswith(".png"):
+        frame = openFrame(source, "c", width, height)
+        drawDisks(frame, xs, ys, diameter, colors)
+        writePNG(output, frame)
+    else:
+        shutil.copyfile(source, output)
+        frame = openFrame(output, "r+", width, height)
+        drawDisks(frame, xs, ys, diameter, colors)
+        frame.flush()
+    return frame.shape
@@ -21,11 +21,37 @@
 # SOFTWARE.
 
 import numpy as np
+import hashlib
+import os
+import weakref
 from datetime import datetime
 
+def _pack_periodic_terms(series):
+    """Pack a list of periodic-term series [[(A, B, C), ...], ...] into arrays
+        Returns (W, B, C) where W is a (series x terms) matrix holding each term's amplitude A in its series' row,
+        so that the sums of A*cos(B + C*x) for every series are np.dot(W, np.cos(B + C*x))
+    """
+    terms = [abc for abcs in series for abc in abcs]
+    W = np.zeros((len(series), len(terms)))
+    j = 0
+    for i, abcs in enumerate(series):
+        W[i, j:j+len(abcs)] = [a for a,b,c in abcs]
+        j += len(abcs)
+    B = np.array([b for a,b,c in terms], dtype=float)
+    C = np.array([c for a,b,c in terms], dtype=float)
+    return W, B, C
+
 class _sp:
     @staticmethod
     def calendar_time(dt):
+        if np.ndim(dt) > 0:
+            #arrays: convert each element, then stack the fields
+            fields = [_sp.calendar_time(d) for d in np.ravel(dt)]
+            if not fields:
+                return tuple(np.zeros(np.shape(dt), dtype=int) for i in range(7))
+            return tuple(np.reshape(f, np.shape(dt)) for f in zip(*fields))
+        if isinstance(dt, np.ndarray):
+            dt = dt.item()
         try:
             x = dt.year, dt.month, dt.day, dt.hour, dt.minute, dt.second, dt.microsecond
             return x
@@ -37,19 +63,51 @@ class _sp:
 
     @staticmethod
     def julian_day(dt):
-        """Calculate the Julian Day from a datetime.datetime object in UTC"""
+        """Calculate the Julian Day from UTC datetime.datetime objects, numpy.datetime64 values or POSIX timestamps"""
+        kind = np.asarray(dt).dtype.kind
+        if kind == 'M':
+            return _sp.julian_day_datetime64(dt)
+        if kind in 'fiu':
+            return _sp.julian_day_timestamp(dt)
+        if kind == 'O' and np.ndim(dt) > 0 and all(isinstance(d, datetime) and d.tzinfo is None for d in np.ravel(dt)):
+            #naive datetimes are converted by numpy in one pass
+            return _sp.julian_day_datetime64(np.array(dt, dtype='datetime64[us]'))
+        return _sp.julian_day_calendar(dt)
+
+    @staticmethod
+    def julian_day_datetime64(dt):
+        """Calculate the Julian Day from numpy.datetime64 values in UTC, NaT gives NaN"""
+        dt = np.asarray(dt, dtype='datetime64[us]')
+        #whole days and microseconds of the day since 1970-01-01 00:00 = JD 2440587.5
+        us = dt.astype(np.int64)
+        days = np.floor_divide(us, 86400*10**6)
+        us = us - days*(86400*10**6)
+        jd = (days + 2440587.5) + us/(24.0*60.0*60.0*1e6)
+        return np.where(np.isnat(dt), np.nan, jd)
+
+    @staticmethod
+    def julian_day_timestamp(ts):
+        """Calculate the Julian Day from POSIX timestamps (seconds since 1970-01-01 00:00 UTC)"""
+        ts = np.asarray(ts, dtype=float)
+        days = np.floor(ts/86400.0)
+        return (days + 2440587.5) + (ts - days*86400.0)/(24.0*60.0*60.0)
+
+    @staticmethod
+    def julian_day_calendar(dt):
+        """Calculate the Julian Day from a datetime.datetime object in UTC, or an array of them"""
         # year and month numbers
         yr, mo, dy, hr, mn, sc, us = _sp.calendar_time(dt)
-        if mo <= 2:  # From paper: "if M = 1 or 2, then Y = Y - 1 and M = M + 12"
-            mo += 12
-            yr -= 1
+        # From paper: "if M = 1 or 2, then Y = Y - 1 and M = M + 12"
+        early = np.less_equal(mo, 2)
+        mo = np.where(early, mo + 12, mo)
+        yr = np.where(early, yr - 1, yr)
         # day of the month with decimal time
         dy = dy + hr/24.0 + mn/(24.0*60.0) + sc/(24.0*60.0*60.0) + us/(24.0*60.0*60.0*1e6)
         # b is equal to 0 for the julian calendar and is equal to (2- A +
         # INT(A/4)), A = INT(Y/100), for the gregorian calendar
-        a = int(yr / 100)
-        b = 2 - a + int(a / 4)
-        jd = int(365.25 * (yr + 4716)) + int(30.6001 * (mo + 1)) + dy + b - 1524.5
+        a = np.fix(yr / 100.0)
+        b = 2 - a + np.fix(a / 4)
+        jd = np.fix(365.25 * (yr + 4716)) + np.fix(30.6001 * (mo + 1)) + dy + b - 1524.5
         return jd
 
     @staticmethod
@@ -161,33 +219,118 @@ class _sp:
                 [(4, 2.56, 6283.08)]
             ]
 
+    #The Earth periodic terms packed into arrays, rows of _EH_W_ are L0..L5, B0, B1, R0..R4
+    _EH_W_, _EH_B_, _EH_C_ = _pack_periodic_terms(_EHL_ + _EHB_ + _EHR_)
+    _EHL_ROWS_ = slice(0, len(_EHL_))
+    _EHB_ROWS_ = slice(len(_EHL_), len(_EHL_) + len(_EHB_))
+    _EHR_ROWS_ = slice(len(_EHL_) + len(_EHB_), len(_EHL_) + len(_EHB_) + len(_EHR_))
+    #number of timestamps evaluated together by earth_periodic_terms, bounds the size of its (terms x timestamps) temporary
+    _BLOCK_ = 4096
+
+    @staticmethod
+    def earth_periodic_terms(jme, term_set=None):
+        """Sum every series of the Earth periodic terms (L0..L5, B0, B1, R0..R4) given the Julian Ephemeris Millennium
+            term_set = None for all of the terms, or the output of periodic_terms
+            Returns an array of shape (13,) + jme.shape
+        """
+        jme = np.asarray(jme, dtype=float)
+        W, B, C = (_sp._EH_W_, _sp._EH_B_, _sp._EH_C_) if term_set is None else term_set[0]
+        #the cosines are evaluated in the precision of the term set, the sums are always in double precision
+        x = jme.reshape(-1).astype(B.dtype)
+        B, C = B[:,None], C[:,None]
+        sums = np.empty((W.shape[0], x.size))
+        for blk in _sp.blocks(x.size):
+            sums[:, blk] = np.dot(W, np.cos(B + C*x[blk]))
+        return sums.reshape(W.shape[:1] + jme.shape)
+
+    @staticmethod
+    def blocks(n):
+        """Split range(n) into slices of at most _BLOCK_ elements"""
+        for i in range(0, n, _sp._BLOCK_):
+            yield slice(i, i + _sp._BLOCK_)
+
+    #largest |Julian Ephemeris Millennium| (1900 - 2100) for which periodic_terms bounds the error
+    _TRUNCATION_JME_ = 0.1
+    #term sets built by periodic_terms, keyed on (precision, float32)
+    _TERM_SETS_ = {}
+
     @staticmethod
-    def heliocentric_longitude(jme):
-        """Compute the Earth Heliocentric Longitude (L) in degrees given the Julian Ephemeris Millennium"""
+    def periodic_terms(precision=None, float32=False):
+        """Select the Earth periodic terms and nutation terms needed for an accuracy of precision degrees
+            Terms are dropped smallest first for as long as the sum of their largest possible contributions
+            to the sun's position over 1900 - 2100 stays below precision.
+            float32 = evaluate the cosines of the terms in single precision
+            Returns None for every term in double precision, otherwise ((W, B, C), (Y, AB, CD)), laid out like
+            (_EH_W_, _EH_B_, _EH_C_) and (_NLO_Y_, _NLO_AB_, _NLO_CD_)
+        """
+        if precision is None and not float32:
+            return None
+        key = (precision, float32)
+        if key not in _sp._TERM_SETS_:
+            W, B, C = _sp._EH_W_, _sp._EH_B_, _sp._EH_C_
+            Y, AB, CD = _sp._NLO_Y_, _sp._NLO_AB_, _sp._NLO_CD_
+            #largest contribution of each term, in degrees: L and B terms move the sun directly, R terms through the
+            #abberation correction and parallax, nutation terms through delta_psi and epsilon (|jce| <= 10*_TRUNCATION_JME_)
+            #constant terms (C = 0) are always kept
+            row = np.argmax(W != 0, axis=0)
+            power = np.r_[np.arange(len(_sp._EHL_)), np.arange(len(_sp._EHB_)), np.arange(len(_sp._EHR_))][row]
+            scale = np.where(row >= _sp._EHR_ROWS_.start, (20.4898 + 8.794)/3600, np.rad2deg(1.0))
+            earth = scale*np.abs(W.sum(axis=0))/1e8*_sp._TRUNCATION_JME_**power
+            earth[C == 0] = np.inf
+            jce = 10*_sp._TRUNCATION_JME_
+            nutation = np.rad2deg(np.abs(AB[0]) + np.abs(AB[1])*jce + np.abs(CD[0]) + np.abs(CD[1])*jce)/36e6
+            keep = np.ones(earth.size + nutation.size, dtype=bool)
+            if precision is not None:
+                error = np.r_[earth, nutation]
+                order = np.argsort(error, kind='mergesort')
+                keep[order[np.cumsum(error[order]) <= precision]] = False
+            ke, kn = keep[:earth.size], keep[earth.size:]
+            dtype = np.float32 if float32 else float
+            _sp._TERM_SETS_[key] = ((W[:,ke], B[ke].astype(dtype), C[ke].astype(dtype)),
+                                    (Y[kn].astype(dtype), AB[:,kn], CD[:,kn]))
+        return _sp._TERM_SETS_[key]
+
+    @staticmethod
+    def heliocentric_longitude(jme, terms=None):
+        """Compute the Earth Heliocentric Longitude (L) in degrees given the Julian Ephemeris Millennium
+            terms = the output of earth_periodic_terms(jme), computed if not given
+        """
+        if terms is None:
+            terms = _sp.earth_periodic_terms(jme)
         #L5, ..., L0
-        Li = [sum(a*np.cos(b + c*jme) for a,b,c in abcs) for abcs in reversed(_sp._EHL_)]
+        Li = terms[_sp._EHL_ROWS_][::-1]
         L = np.polyval(Li, jme) / 1e8
         L = np.rad2deg(L) % 360
         return L
     @staticmethod
-    def heliocentric_latitude(jme):
-        """Compute the Earth Heliocentric Latitude (B) in degrees given the Julian Ephemeris Millennium"""
-        Bi = [sum(a*np.cos(b + c*jme) for a,b,c in abcs) for abcs in reversed(_sp._EHB_)]
+    def heliocentric_latitude(jme, terms=None):
+        """Compute the Earth Heliocentric Latitude (B) in degrees given the Julian Ephemeris Millennium
+            terms = the output of earth_periodic_terms(jme), computed if not given
+        """
+        if terms is None:
+            terms = _sp.earth_periodic_terms(jme)
+        Bi = terms[_sp._EHB_ROWS_][::-1]
         B = np.polyval(Bi, jme) / 1e8
         B = np.rad2deg(B) % 360
         return B
     @staticmethod
-    def heliocentric_radius(jme):
-        """Compute the Earth Heliocentric Radius (R) in astronimical units given the Julian Ephemeris Millennium"""
-        Ri = [sum(a*np.cos(b + c*jme) for a,b,c in abcs) for abcs in reversed(_sp._EHR_)]
+    def heliocentric_radius(jme, terms=None):
+        """Compute the Earth Heliocentric Radius (R) in astronimical units given the Julian Ephemeris Millennium
+            terms = the output of earth_periodic_terms(jme), computed if not given
+        """
+        if terms is None:
+            terms = _sp.earth_periodic_terms(jme)
+        Ri = terms[_sp._EHR_ROWS_][::-1]
         R = np.polyval(Ri, jme) / 1e8
         return R
     @staticmethod
-    def heliocentric_position(jme):
+    def heliocentric_position(jme, term_set=None):
         """Compute the Earth Heliocentric Longitude, Latitude, and Radius given the Julian Ephemeris Millennium
             Returns (L, B, R) where L = longitude in degrees, B = latitude in degrees, and R = radius in astronimical units
+            term_set = None for all of the periodic terms, or the output of periodic_terms
         """
-        return _sp.heliocentric_longitude(jme), _sp.heliocentric_latitude(jme), _sp.heliocentric_radius(jme)
+        terms = _sp.earth_periodic_terms(jme, term_set)
+        return _sp.heliocentric_longitude(jme, terms), _sp.heliocentric_latitude(jme, terms), _sp.heliocentric_radius(jme, terms)
     @staticmethod
     def geocentric_position(helio_pos):
         """Compute the geocentric latitude (Theta) and longitude (beta) (in degrees) of the sun given the earth's heliocentric position (L, B, R)"""
@@ -244,6 +387,11 @@ class _sp:
                (0,   0), (-3,  0), (-3,  0), (3,   0),
                (3,   0), (0,   0), (3,   0), (3,   0),
                (3,   0)]
+    #The nutation coefficients packed into arrays: Y is (63 x 5), AB and CD are (2 x 63)
+    #CD is padded with zeros, the paper lists no (c,d) for the last 14 terms
+    _NLO_Y_ = np.array(_NLOY_, dtype=float)
+    _NLO_AB_ = np.array(_NLOab_, dtype=float).T
+    _NLO_CD_ = np.vstack((np.array(_NLOcd_, dtype=float), np.zeros((len(_NLOY_) - len(_NLOcd_), 2)))).T
 
     @staticmethod
     def ecliptic_obliquity(jme, delta_epsilon):
@@ -254,8 +402,10 @@ class _sp:
         return e
 
     @staticmethod
-    def nutation_obliquity(jce):
-        """compute the nutation in longitude (delta_psi) and the true obliquity (epsilon) given the Julian Ephemeris Century"""
+    def nutation_obliquity(jce, term_set=None):
+        """compute the nutation in longitude (delta_psi) and the true obliquity (epsilon) given the Julian Ephemeris Century
+            term_set = None for all of the nutation terms, or the output of periodic_terms
+        """
         
         #mean elongation of the moon from the sun, in radians:
         #x0 = 297.85036 + 445267.111480*jce - 0.0019142*(jce**2) + (jce**3)/189474
@@ -270,19 +420,25 @@ class _sp:
         # measured from the mean equinox of the date, in radians
         x4 = np.deg2rad(np.polyval([1./45e4, 0.0020708, -1934.136261, 125.04452], jce))
 
-        x = (x0, x1, x2, x3, x4)
+        jce = np.asarray(jce, dtype=float)
+        x = np.array(np.broadcast_arrays(x0, x1, x2, x3, x4, jce)).reshape(6, -1)
+        x, t = x[:5], x[5]
+        Y, AB, CD = (_sp._NLO_Y_, _sp._NLO_AB_, _sp._NLO_CD_) if term_set is None else term_set[1]
+        if Y.dtype != x.dtype:
+            #Y is integer valued, so reducing the arguments first keeps the accuracy in single precision
+            x = (x % (2*np.pi)).astype(Y.dtype)
 
-        dp = 0.0
-        for y, ab in zip(_sp._NLOY_, _sp._NLOab_):
-            a,b = ab
-            dp += (a + b*jce)*np.sin(np.dot(x, y))
-        dp = np.rad2deg(dp)/36e6
-
-        de = 0.0
-        for y, cd in zip(_sp._NLOY_, _sp._NLOcd_):
-            c,d = cd
-            de += (c + d*jce)*np.cos(np.dot(x, y))
-        de = np.rad2deg(de)/36e6
+        #sum((a + b*jce)*sin(Y.x)) and sum((c + d*jce)*cos(Y.x)) over the 63 terms
+        dp = np.empty(t.shape)
+        de = np.empty(t.shape)
+        for blk in _sp.blocks(t.size):
+            yx = np.dot(Y, x[:, blk])
+            ab = np.dot(AB, np.sin(yx))
+            cd = np.dot(CD, np.cos(yx))
+            dp[blk] = ab[0] + ab[1]*t[blk]
+            de[blk] = cd[0] + cd[1]*t[blk]
+        dp = np.rad2deg(dp.reshape(jce.shape))/36e6
+        de = np.rad2deg(de.reshape(jce.shape))/36e6
 
         e = _sp.ecliptic_obliquity(_sp.julian_millennium(jce), de)
 
@@ -322,15 +478,82 @@ class _sp:
         return alpha, delta
     
     @staticmethod
-    def sun_topo_ra_decl_hour(latitude, longitude, elevation, jd, delta_t = 0):
-        """Calculate the sun's topocentric right ascension (alpha'), declination (delta'), and hour angle (H')"""
-        
-        jde = _sp.julian_ephemeris_day(jd, delta_t)
+    def sun_ephemeris(jde, term_set=None):
+        """Calculate the parts of the sun's position that depend only on the Julian Ephemeris Day
+            Returns (alpha, delta, R, delta_psi, epsilon): the sun's geocentric right ascension and declination in degrees,
+            the Earth Heliocentric Radius in astronomical units, the nutation in longitude and the true obliquity in degrees
+            term_set = None for all of the periodic terms, or the output of periodic_terms
+        """
         jce = _sp.julian_century(jde)
         jme = _sp.julian_millennium(jce)
 
-        helio_pos = _sp.heliocentric_position(jme)
+        helio_pos = _sp.heliocentric_position(jme, term_set)
         R = helio_pos[-1]
+
+        delta_psi, epsilon = _sp.nutation_obliquity(jce, term_set) #
+
+        llambda, beta = _sp.sun_longitude(helio_pos, delta_psi) #
+        
+        alpha, delta = _sp.sun_ra_decl(llambda, epsilon, beta) #
+
+        return alpha, delta, R, delta_psi, epsilon
+
+    @staticmethod
+    def sun_geocentric(jd, delta_t = 0, ephemeris = None, term_set = None):
+        """Calculate the parts of the sun's position that depend only on time
+            Returns (alpha, delta, v, R): the sun's geocentric right ascension and declination, the apparent Greenwich sidereal time
+            (all in degrees) and the Earth Heliocentric Radius in astronomical units
+            ephemeris = None to evaluate the periodic-term series, or Chebyshev ephemeris records (see fit_ephemeris)
+            term_set = None for all of the periodic terms, or the output of periodic_terms
+        """
+        jde = _sp.julian_ephemeris_day(jd, delta_t)
+        if ephemeris is None:
+            alpha, delta, R, delta_psi, epsilon = _sp.sun_ephemeris(jde, term_set)
+        else:
+            alpha, delta, R, delta_psi, epsilon = _sp.chebyshev_ephemeris(ephemeris, jde)
+
+        v = _sp.greenwich_sidereal_time(jd, delta_psi, epsilon) #
+
+        return alpha, delta, v, R
+
+    #order of the quantities in the Chebyshev ephemeris records, the same as sun_ephemeris returns
+    _CHEB_QUANTITIES_ = ('alpha', 'delta', 'R', 'delta_psi', 'epsilon')
+
+    @staticmethod
+    def chebyshev_ephemeris(records, jde):
+        """Evaluate Chebyshev ephemeris records (see fit_ephemeris) at the given Julian Ephemeris Days
+            Returns (alpha, delta, R, delta_psi, epsilon) like sun_ephemeris
+        """
+        jde = np.asarray(jde, dtype=float)
+        t = jde.reshape(-1)
+        nq = len(_sp._CHEB_QUANTITIES_)
+        start, span = records[0,0], records[0,1] - records[0,0]
+        if t.size == 0:
+            return tuple(np.empty(jde.shape) for q in range(nq))
+        idx = np.floor((t - start)/span).astype(int)
+        if idx.min() < 0 or idx.max() >= records.shape[0]:
+            raise ValueError('time is outside of the ephemeris range')
+        #only the records that are needed are read from a memory-mapped file
+        rec = np.asarray(records[idx])
+        x = 2*(t - rec[:,0])/span - 1
+        c = rec[:,2:].reshape(t.size, nq, -1)
+        #Chebyshev polynomials T_k(x), shared by all of the quantities
+        T = np.empty((c.shape[2], t.size))
+        T[0] = 1
+        if c.shape[2] > 1:
+            T[1] = x
+        for k in range(2, c.shape[2]):
+            T[k] = 2*x*T[k-1] - T[k-2]
+        y = np.einsum('ki,iqk->qi', T, c)
+        alpha, delta, R, delta_psi, epsilon = [q.reshape(jde.shape) for q in y]
+        return alpha % 360, delta, R, delta_psi, epsilon
+
+    @staticmethod
+    def sun_topocentric(latitude, longitude, elevation, geo):
+        """Calculate the sun's topocentric right ascension (alpha'), declination (delta'), and hour angle (H')
+            given the observer's location and the output of sun_geocentric
+        """
+        alpha, delta, v, R = geo
         phi, sigma, E = latitude, longitude, elevation
         #equatorial horizontal parallax of the sun, in radians
         xi = np.deg2rad(8.794/(3600*R)) #
@@ -343,14 +566,6 @@ class _sp:
         x = np.cos(u) + E*np.cos(phi)/6378140 #rho sin(phi-prime)
         y = 0.99664719*np.sin(u) + E*np.sin(phi)/6378140 #rho cos(phi-prime)
 
-        delta_psi, epsilon = _sp.nutation_obliquity(jce) #
-
-        llambda, beta = _sp.sun_longitude(helio_pos, delta_psi) #
-        
-        alpha, delta = _sp.sun_ra_decl(llambda, epsilon, beta) #
-
-        v = _sp.greenwich_sidereal_time(jd, delta_psi, epsilon) #
-
         H = v + longitude - alpha #
         Hr, dr = map(np.deg2rad,(H,delta))
 
@@ -362,6 +577,17 @@ class _sp:
         H_prime = H - delta_alpha #
 
         return alpha_prime, delta_prime, H_prime
+
+    @staticmethod
+    def sun_topo_ra_decl_hour(latitude, longitude, elevation, jd, delta_t = 0, ephemeris = None, cache = None, term_set = None):
+        """Calculate the sun's topocentric right ascension (alpha'), declination (delta'), and hour angle (H')
+            cache = None, or a SunposCache to look up and store the output of sun_geocentric
+        """
+        if cache is None:
+            geo = _sp.sun_geocentric(jd, delta_t, ephemeris, term_set)
+        else:
+            geo = cache.geocentric(jd, delta_t, ephemeris, term_set)
+        return _sp.sun_topocentric(latitude, longitude, elevation, geo)
     
     @staticmethod
     def sun_topo_azimuth_zenith(latitude, delta_prime, H_prime, temperature=14.6, pressure=1013):
@@ -383,34 +609,86 @@ class _sp:
         Phi = (gamma + 180) % 360 #azimuth from north
         return Phi, zenith
 
+    @staticmethod
+    def rise_transit_set(jd0, latitude, longitude, h0_prime=-0.8333, delta_t=0):
+        """Calculate the sun's transit, rise and set times as fractions of the day starting at jd0 (0h UT)
+            h0_prime = the sun's geometric altitude at rise and set in degrees, -0.8333 for the upper limb at the horizon
+            Follows the appendix of the paper: three geocentric evaluations (at 0h of the day before, the day, and the day after)
+            are interpolated, and rise and set are refined with one correction step
+            Returns (T, R, S, polar), R and S are NaN when the sun doesn't reach h0_prime (or doesn't go below it) that day,
+            polar is 1 on those days when the sun stays above h0_prime, -1 when it stays below, and 0 otherwise
+        """
+        #the geocentric quantities at 0h UT only depend on the day, not on the site
+        jd0 = np.asarray(jd0, dtype=float)
+        days = jd0[...,None] + np.array([-1.0, 0.0, 1.0])
+        alpha, delta, v, R = _sp.sun_geocentric(days, 0)
+        nu = v[...,1]
+
+        phi = np.deg2rad(latitude)
+        sigma = np.asarray(longitude, dtype=float)
+        h0r = np.deg2rad(h0_prime)
+
+        #approximate times, fractions of the day
+        m0 = (alpha[...,1] - sigma - nu)/360
+        cos_H0 = (np.sin(h0r) - np.sin(phi)*np.sin(np.deg2rad(delta[...,1])))/(np.cos(phi)*np.cos(np.deg2rad(delta[...,1])))
+        never = np.abs(cos_H0) > 1
+        #cos_H0 < -1: the sun never gets down to h0_prime, cos_H0 > 1: it never gets up to it
+        polar = np.where(never, -np.sign(cos_H0), 0).astype(np.int8)
+        H0 = np.rad2deg(np.arccos(np.clip(cos_H0, -1, 1)))
+        #rise and set are kept on either side of the transit, so they may fall on the neighbouring days
+        m0 = m0 % 1
+        m = np.array(np.broadcast_arrays(m0, m0 - H0/360, m0 + H0/360))
+
+        #interpolate the geocentric quantities to those times, a and b wrap across 0/360 right ascension
+        n = m + np.asarray(delta_t)/86400.0
+        def interpolate(q, wrap):
+            a = q[...,1] - q[...,0]
+            b = q[...,2] - q[...,1]
+            if wrap:
+                a = (a + 180) % 360 - 180
+                b = (b + 180) % 360 - 180
+            return q[...,1] + n*(a + b + (b - a)*n)/2
+        alpha_i = interpolate(alpha, True)
+        delta_i = np.deg2rad(interpolate(delta, False))
+        nu_i = nu + 360.985647*m
+        H_i = (nu_i + sigma - alpha_i + 180) % 360 - 180
+        Hr = np.deg2rad(H_i)
+        h_i = np.arcsin(np.sin(phi)*np.sin(delta_i) + np.cos(phi)*np.cos(delta_i)*np.cos(Hr))
+
+        T = m[0] - H_i[0]/360
+        rs = m[1:] + np.rad2deg(h_i[1:] - h0r)/(360*np.cos(delta_i[1:])*np.cos(phi)*np.sin(Hr[1:]))
+        rs = np.where(never, np.nan, rs)
+        return T, rs[0], rs[1], polar
+
     @staticmethod
     def norm_lat_lon(lat,lon):
-        if lat < -90 or lat > 90:
+        lat, lon = np.asarray(lat, dtype=float), np.asarray(lon, dtype=float)
+        polar = (lat < -90) | (lat > 90)
+        if np.any(polar):
             #convert to cartesian and back
-            x = cos(deg2rad(lon))*cos(deg2rad(lat))
-            y = sin(deg2rad(lon))*cos(deg2rad(lat))
-            z = sin(deg2rad(lat))
-            r = sqrt(x**2 + y**2 + z**2)
-            lon = rad2deg(arctan2(y,x)) % 360
-            lat = rad2deg(arcsin(z/r))
-        elif lon < 0 or lon > 360:
-            lon = lon % 360
+            x = np.cos(np.deg2rad(lon))*np.cos(np.deg2rad(lat))
+            y = np.sin(np.deg2rad(lon))*np.cos(np.deg2rad(lat))
+            z = np.sin(np.deg2rad(lat))
+            r = np.sqrt(x**2 + y**2 + z**2)
+            lon = np.where(polar, np.rad2deg(np.arctan2(y,x)) % 360, lon)
+            lat = np.where(polar, np.rad2deg(np.arcsin(z/r)), lat)
+        lon = np.where(~polar & ((lon < 0) | (lon > 360)), lon % 360, lon)
         return lat,lon
 
     @staticmethod
-    def topo_pos(t,lat,lon,elev,temp,press,dt):
+    def topo_pos(t,lat,lon,elev,temp,press,dt,ephemeris=None,cache=None,term_set=None):
         """compute RA,dec,H, all in degrees"""
         lat,lon = _sp.norm_lat_lon(lat,lon)
         jd = _sp.julian_day(t)
-        RA, dec, H = _sp.sun_topo_ra_decl_hour(lat, lon, elev, jd, dt)
+        RA, dec, H = _sp.sun_topo_ra_decl_hour(lat, lon, elev, jd, dt, ephemeris, cache, term_set)
         return RA, dec, H
 
     @staticmethod
-    def pos(t,lat,lon,elev,temp,press,dt):
+    def pos(t,lat,lon,elev,temp,press,dt,ephemeris=None,cache=None,term_set=None):
         """Compute azimute,zenith,RA,dec,H all in degrees"""
         lat,lon = _sp.norm_lat_lon(lat,lon)
         jd = _sp.julian_day(t)
-        RA, dec, H = _sp.sun_topo_ra_decl_hour(lat, lon, elev, jd, dt)
+        RA, dec, H = _sp.sun_topo_ra_decl_hour(lat, lon, elev, jd, dt, ephemeris, cache, term_set)
         azimuth, zenith = _sp.sun_topo_azimuth_zenith(lat, dec, H, temp, press)
         return azimuth,zenith,RA,dec,H
 
@@ -420,21 +698,14 @@ def julian_day(dt):
     Parameters
     ----------
     dt : array_like
-        UTC datetime objects or UTC timestamps (as per datetime.utcfromtimestamp)
+        UTC datetime objects, numpy.datetime64 values or UTC timestamps (as per datetime.utcfromtimestamp)
 
     Returns
     -------
     jd : ndarray
         datetimes converted to fractional Julian days
     """
-    dts = np.array(dt)
-    if len(dts.shape) == 0:
-        return _sp.julian_day(dt)
-
-    jds = np.empty(dts.shape)
-    for i,d in enumerate(dts.flat):
-        jds.flat[i] = _sp.julian_day(d)
-    return jds
+    return _sp.julian_day(np.asarray(dt))
 
 def arcdist(p0,p1,radians=False):
     """Angular distance between azimuth,zenith pairs
@@ -467,13 +738,237 @@ def arcdist(p0,p1,radians=False):
     else:
         return np.rad2deg(d)
 
-def observed_sunpos(dt, latitude, longitude, elevation, temperature=None, pressure=None, delta_t=0, radians=False):
+class SunposCache(object):
+    """Bounded least-recently-used cache of the time-dependent part of the sun position
+
+    Pass an instance as sunpos(..., cache=cache) to reuse the heliocentric position, nutation and
+    geocentric RA/dec of times that were computed before, so that repeated times only cost the topocentric step.
+    Entries are keyed on the Julian Ephemeris Day, delta_t and what they were computed from: the Chebyshev ephemeris
+    records (by content), or the set of periodic terms selected by precision and float32, so one cache can be shared
+    between calls with different ephemerides and precisions.
+    Each call looks every distinct time up once and copies the cached values with array indexing, entries used by
+    the same call are equally recent.
+
+    Parameters
+    ----------
+    maxsize : int, optional
+        maximum number of times to keep, default is 4096
+
+    Attributes
+    ----------
+    hits, misses : int
+        number of times found in and missing from the cache so far
+
+    Examples
+    --------
+    A second call at the same times, here for two sites, finds all of them and doesn't evaluate sun_geocentric again
+
+    >>> cache = SunposCache()
+    >>> t = np.datetime64('2019-06-21T00:00') + np.arange(48)*np.timedelta64(30, 'm')
+    >>> first = sunpos(t, 30, 120, 0, cache=cache)
+    >>> second = sunpos(t, [[30], [40]], 120, 0, cache=cache)
+    >>> cache.hits, cache.misses
+    (48, 48)
+    """
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self._digests = {}
+        self.clear()
+
+    def __len__(self):
+        return len(self._rows)
+
+    def clear(self):
+        """Remove all entries and reset the counters"""
+        self._rows = {} #key -> row of _values
+        self._keys = [] #key of each row
+        self._values = np.empty((0, 4))
+        self._used = np.empty(0, dtype=np.int64) #number of the last call that used each row
+        self._calls = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _source(self, ephemeris, term_set):
+        """Identify what the entries are computed from
+            ephemeris records are hashed, once per records object, since equal records may be loaded anew
+        """
+        if ephemeris is not None:
+            entry = self._digests.get(id(ephemeris))
+            if entry is None or entry[0]() is not ephemeris:
+                records = np.ascontiguousarray(ephemeris, dtype=float)
+                digest = ('ephemeris', records.shape, hashlib.sha1(records).hexdigest())
+                key = id(ephemeris)
+                #the digest is forgotten with the records, so a new object reusing the id is hashed again
+                ref = weakref.ref(ephemeris, lambda ref, key=key, digests=self._digests: digests.pop(key, None))
+                entry = self._digests[key] = (ref, digest)
+            return entry[1]
+        if term_set is None:
+            return ('terms', None, False)
+        #term sets are memoized by periodic_terms, so their identity is the (precision, float32) they were selected with
+        for key, terms in _sp._TERM_SETS_.items():
+            if terms is term_set:
+                return ('terms',) + key
+        raise ValueError('term_set must come from _sp.periodic_terms')
+
+    def _store(self, keys, values):
+        """Add entries for keys, missing from the cache, reusing the rows of the least recently used entries when full"""
+        keys, values = keys[len(keys) - self.maxsize:], values[len(keys) - self.maxsize:]
+        append = max(min(len(keys), self.maxsize - len(self._keys)), 0)
+        rows = np.arange(len(self._keys), len(self._keys) + append)
+        if len(keys) > append:
+            oldest = np.argsort(self._used, kind='mergesort')[:len(keys) - append]
+            for row in oldest.tolist():
+                del self._rows[self._keys[row]]
+            rows = np.r_[oldest, rows]
+        self._keys.extend([None]*append)
+        self._values = np.concatenate([self._values, np.empty((append, 4))])
+        self._used = np.concatenate([self._used, np.empty(append, dtype=np.int64)])
+        for row, key in zip(rows.tolist(), keys):
+            self._keys[row] = key
+            self._rows[key] = row
+        self._values[rows] = values
+        self._used[rows] = self._calls
+
+    def geocentric(self, jd, delta_t=0, ephemeris=None, term_set=None):
+        """Look up _sp.sun_geocentric(jd, delta_t, ephemeris, term_set), computing and storing the missing times"""
+        jd, delta_t = np.broadcast_arrays(np.asarray(jd, dtype=float), np.asarray(delta_t, dtype=float))
+        source = self._source(ephemeris, term_set)
+        self._calls += 1
+        #each distinct time is looked up once, however often it repeats in jd
+        times = np.array([_sp.julian_ephemeris_day(jd, delta_t).ravel(), delta_t.ravel()])
+        if times.shape[1] > 1:
+            times, first, inverse = np.unique(times, axis=1, return_index=True, return_inverse=True)
+        else:
+            first = inverse = np.zeros(times.shape[1], dtype=int)
+        keys = [(source, jde, dt) for jde, dt in zip(times[0].tolist(), times[1].tolist())]
+        get = self._rows.get
+        rows = np.array([get(key, -1) for key in keys], dtype=int)
+        found = rows >= 0
+        geo = np.empty((len(keys), 4))
+        geo[found] = self._values[rows[found]]
+        self._used[rows[found]] = self._calls
+        missing = np.flatnonzero(~found)
+        counts = np.bincount(inverse, minlength=len(keys))
+        self.hits += int(counts[found].sum())
+        self.misses += int(counts[missing].sum())
+        if missing.size:
+            computed = np.array(_sp.sun_geocentric(jd.ravel()[first[missing]], delta_t.ravel()[first[missing]], ephemeris, term_set)).T
+            geo[missing] = computed
+            self._store([keys[i] for i in missing.tolist()], computed)
+        geo = geo[inverse]
+        return tuple(g.reshape(jd.shape) for g in geo.T)
+
+def _evaluate(func, columns, args, kwargs, vectorize=True, radians=False, out=None, dtype=None, chunk_size=None, workers=None, executor=None):
+    """Broadcast args together and evaluate func (_sp.pos or _sp.topo_pos) on them, keeping the given columns of its output
+        kwargs are passed on to func unchanged
+        The results are written to out, which is allocated with the broadcast shape plus a final dimension of len(columns) if None
+        chunk_size = None to evaluate everything in one pass, or the number of entries along the first broadcast dimension per pass
+        workers, executor = number of worker processes, or an executor to map the chunks over (see _evaluate_parallel)
+    """
+    #numpy broadcasting
+    b = np.broadcast(*args)
+    shape = b.shape + (len(columns),)
+    if out is not None and out.shape != shape:
+        raise ValueError('out must have shape {0}, not {1}'.format(shape, out.shape))
+    if (executor is not None or (workers or 1) > 1) and b.shape:
+        return _evaluate_parallel(func, columns, args, kwargs, vectorize, radians, out, dtype, chunk_size, workers, executor)
+    if isinstance(kwargs.get('ephemeris'), str):
+        kwargs['ephemeris'] = _loaded_ephemeris(kwargs['ephemeris'])
+    if out is None:
+        out = np.empty(shape, dtype=float if dtype is None else dtype)
+    if vectorize:
+        #arguments are not broadcast up front, so the time-only terms are computed
+        #once per distinct time even when the results vary over sites as well
+        args = [np.asarray(x) for x in args]
+        if chunk_size is None or not b.shape:
+            chunks = [slice(None)]
+        else:
+            chunks = [slice(i, i + chunk_size) for i in range(0, b.shape[0], chunk_size)]
+        for chunk in chunks:
+            #only the arguments that span the first dimension are sliced, the others broadcast as before
+            part = [x[chunk] if x.ndim == len(b.shape) and x.ndim and x.shape[0] > 1 else x for x in args]
+            coords = func(*part, **kwargs)
+            res = out[chunk] if b.shape else out
+            for j, c in enumerate(columns):
+                res[...,j] = np.deg2rad(coords[c]) if radians else coords[c]
+    else:
+        for idx, x in zip(np.ndindex(*b.shape), b):
+            coords = np.array(func(*x, **kwargs))[list(columns)]
+            out[idx] = np.deg2rad(coords) if radians else coords
+    return out
+
+def _evaluate_parallel(func, columns, args, kwargs, vectorize, radians, out, dtype, chunk_size, workers, executor):
+    """Split _evaluate along the first broadcast dimension and evaluate the chunks in worker processes
+        The workers write their results straight into a memory-mapped file (out itself if it is a numpy.memmap),
+        so only the inputs of each chunk are pickled.
+        executor = None to use a multiprocessing.Pool of workers processes, otherwise any object with a map method
+        (such as multiprocessing.Pool or concurrent.futures.ProcessPoolExecutor)
+    """
+    if kwargs.get('cache') is not None:
+        raise ValueError('a SunposCache can not be shared with worker processes')
+    b = np.broadcast(*args)
+    shape = b.shape + (len(columns),)
+    rows = b.shape[0]
+    if chunk_size is None:
+        chunk_size = -(-rows // (4*(workers or 1)))
+    #chunks start at multiples of _BLOCK_ so that the periodic terms of each chunk are summed
+    #in the same blocks as the serial path, which makes the results identical
+    chunk_size = -(-chunk_size // _sp._BLOCK_)*_sp._BLOCK_
+
+    #imported here to keep them out of the startup of scripts that never go parallel
+    import multiprocessing
+    import tempfile
+
+    if isinstance(out, np.memmap) and out.filename and out.flags.c_contiguous:
+        res, filename, offset, tmp = out, out.filename, out.offset, False
+    else:
+        fd, filename = tempfile.mkstemp(suffix='.dat', prefix='sunpos')
+        os.close(fd)
+        res_dtype = out.dtype if out is not None else np.dtype(float if dtype is None else dtype)
+        res, offset, tmp = np.memmap(filename, dtype=res_dtype, mode='w+', shape=shape), 0, True
+    res.flush()
+
+    args = [np.asarray(x) for x in args]
+    tasks = []
+    for i in range(0, rows, chunk_size):
+        chunk = slice(i, i + chunk_size)
+        part = [x[chunk] if x.ndim == len(b.shape) and x.shape[0] > 1 else x for x in args]
+        tasks.append((func.__name__, columns, part, kwargs, vectorize, radians, filename, res.dtype.str, shape, offset, chunk))
+    try:
+        if executor is None:
+            pool = multiprocessing.Pool(workers)
+            try:
+                pool.map(_evaluate_chunk, tasks)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            list(executor.map(_evaluate_chunk, tasks))
+        if tmp:
+            if out is None:
+                out = np.array(res)
+            else:
+                out[...] = res
+    finally:
+        if tmp:
+            del res
+            os.remove(filename)
+    return out
+
+def _evaluate_chunk(task):
+    """Evaluate one chunk of _evaluate_parallel in a worker process"""
+    name, columns, args, kwargs, vectorize, radians, filename, dtype, shape, offset, chunk = task
+    res = np.memmap(filename, dtype=dtype, mode='r+', offset=offset, shape=shape)
+    _evaluate(getattr(_sp, name), columns, args, kwargs, vectorize, radians, out=res[chunk])
+    res.flush()
+
+def observed_sunpos(dt, latitude, longitude, elevation, temperature=None, pressure=None, delta_t=0, radians=False, vectorize=True, ephemeris=None, cache=None, out=None, dtype=None, chunk_size=None, workers=None, executor=None, precision=None, float32=False):
     """Compute the observed coordinates of the sun as viewed at the given time and location.
 
     Parameters
     ----------
-    dt : array_like of datetime or float
-        UTC datetime objects or UTC timestamps (as per datetime.utcfromtimestamp) representing the times of observations
+    dt : array_like of datetime, datetime64 or float
+        UTC datetime objects, numpy.datetime64 values or UTC timestamps (as per datetime.utcfromtimestamp) representing the times of observations
     latitude, longitude : array_like of float
         decimal degrees, positive for north of the equator and east of Greenwich
     elevation : array_like of float
@@ -486,6 +981,33 @@ def observed_sunpos(dt, latitude, longitude, elevation, temperature=None, pressu
         seconds, default is 0, difference between the earth's rotation time (TT) and universal time (UT)
     radians : bool, optional
         return results in radians if True, degrees if False (default)
+    vectorize : bool, optional
+        if True (default), evaluate every point at once with array operations,
+        otherwise evaluate the points one at a time (the scalar reference implementation)
+    ephemeris : None, str or ndarray, optional
+        Chebyshev ephemeris records from fit_ephemeris or load_ephemeris, or the name of a .npy file holding them,
+        to use instead of the full periodic-term series. Default is None (full series)
+    cache : None or SunposCache, optional
+        cache of the time-dependent part of the computation, to reuse between calls with the same times. Default is None
+    out : None or ndarray, optional
+        array to write the results to, for example a numpy.memmap, instead of allocating a new one.
+        Must have the shape of the results
+    dtype : None or dtype, optional
+        data type of the results when out is None, default is float64
+    chunk_size : None or int, optional
+        evaluate this many entries of the first broadcast dimension at a time, to bound the memory used
+        for intermediate values. Default is None (everything at once)
+    workers : None or int, optional
+        number of worker processes to split the computation over, default is None (no worker processes).
+        Results are identical to the serial computation
+    executor : None or executor, optional
+        a multiprocessing.Pool, concurrent.futures.ProcessPoolExecutor or similar to run the worker chunks on
+        instead of starting a new pool. Default is None
+    precision : None or float, optional
+        required accuracy in degrees. Periodic terms are dropped, smallest first, while the sum of their largest
+        contributions over 1900 - 2100 stays below it (see README for the measured errors). Default is None (all terms)
+    float32 : bool, optional
+        evaluate the periodic terms in single precision, default is False
 
     Returns
     -------
@@ -500,23 +1022,17 @@ def observed_sunpos(dt, latitude, longitude, elevation, temperature=None, pressu
         pressure = 1013
     
     #6367444 = radius of earth
-    #numpy broadcasting
-    b = np.broadcast(dt,latitude,longitude,elevation,temperature,pressure,delta_t)
-    res = np.empty(b.shape+(2,))
-    res_vec = res.reshape((-1,2))
-    for i,x in enumerate(b):
-        res_vec[i] = _sp.pos(*x)[:2]
-    if radians:
-        res = np.deg2rad(res)
-    return res
+    args = (dt,latitude,longitude,elevation,temperature,pressure,delta_t)
+    kwargs = dict(ephemeris=ephemeris, cache=cache, term_set=_sp.periodic_terms(precision, float32))
+    return _evaluate(_sp.pos, (0, 1), args, kwargs, vectorize, radians, out, dtype, chunk_size, workers, executor)
 
-def topocentric_sunpos(dt, latitude, longitude, temperature=None, pressure=None, delta_t=0, radians=False):
+def topocentric_sunpos(dt, latitude, longitude, elevation, temperature=None, pressure=None, delta_t=0, radians=False, vectorize=True, ephemeris=None, cache=None, out=None, dtype=None, chunk_size=None, workers=None, executor=None, precision=None, float32=False):
     """Compute the topocentric coordinates of the sun as viewed at the given time and location.
 
     Parameters
     ----------
-    dt : array_like of datetime or float
-        UTC datetime objects or UTC timestamps (as per datetime.utcfromtimestamp) representing the times of observations
+    dt : array_like of datetime, datetime64 or float
+        UTC datetime objects, numpy.datetime64 values or UTC timestamps (as per datetime.utcfromtimestamp) representing the times of observations
     latitude, longitude : array_like of float
         decimal degrees, positive for north of the equator and east of Greenwich
     elevation : array_like of float
@@ -529,6 +1045,33 @@ def topocentric_sunpos(dt, latitude, longitude, temperature=None, pressure=None,
         seconds, default is 0, difference between the earth's rotation time (TT) and universal time (UT)
     radians : bool, optional
         return results in radians if True, degrees if False (default)
+    vectorize : bool, optional
+        if True (default), evaluate every point at once with array operations,
+        otherwise evaluate the points one at a time (the scalar reference implementation)
+    ephemeris : None, str or ndarray, optional
+        Chebyshev ephemeris records from fit_ephemeris or load_ephemeris, or the name of a .npy file holding them,
+        to use instead of the full periodic-term series. Default is None (full series)
+    cache : None or SunposCache, optional
+        cache of the time-dependent part of the computation, to reuse between calls with the same times. Default is None
+    out : None or ndarray, optional
+        array to write the results to, for example a numpy.memmap, instead of allocating a new one.
+        Must have the shape of the results
+    dtype : None or dtype, optional
+        data type of the results when out is None, default is float64
+    chunk_size : None or int, optional
+        evaluate this many entries of the first broadcast dimension at a time, to bound the memory used
+        for intermediate values. Default is None (everything at once)
+    workers : None or int, optional
+        number of worker processes to split the computation over, default is None (no worker processes).
+        Results are identical to the serial computation
+    executor : None or executor, optional
+        a multiprocessing.Pool, concurrent.futures.ProcessPoolExecutor or similar to run the worker chunks on
+        instead of starting a new pool. Default is None
+    precision : None or float, optional
+        required accuracy in degrees. Periodic terms are dropped, smallest first, while the sum of their largest
+        contributions over 1900 - 2100 stays below it (see README for the measured errors). Default is None (all terms)
+    float32 : bool, optional
+        evaluate the periodic terms in single precision, default is False
 
     Returns
     -------
@@ -544,23 +1087,17 @@ def topocentric_sunpos(dt, latitude, longitude, temperature=None, pressure=None,
         pressure = 1013
     
     #6367444 = radius of earth
-    #numpy broadcasting
-    b = np.broadcast(dt,latitude,longitude,elevation,temperature,pressure,delta_t)
-    res = np.empty(b.shape+(2,))
-    res_vec = res.reshape((-1,2))
-    for i,x in enumerate(b):
-        res_vec[i] = _sp.topo_pos(*x)
-    if radians:
-        res = np.deg2rad(res)
-    return res   
+    args = (dt,latitude,longitude,elevation,temperature,pressure,delta_t)
+    kwargs = dict(ephemeris=ephemeris, cache=cache, term_set=_sp.periodic_terms(precision, float32))
+    return _evaluate(_sp.topo_pos, (0, 1, 2), args, kwargs, vectorize, radians, out, dtype, chunk_size, workers, executor)
 
-def sunpos(dt, latitude, longitude, elevation, temperature=None, pressure=None, delta_t=0, radians=False):
+def sunpos(dt, latitude, longitude, elevation, temperature=None, pressure=None, delta_t=0, radians=False, vectorize=True, ephemeris=None, cache=None, columns=None, out=None, dtype=None, chunk_size=None, workers=None, executor=None, precision=None, float32=False):
     """Compute the observed and topocentric coordinates of the sun as viewed at the given time and location.
 
     Parameters
     ----------
-    dt : array_like of datetime or float
-        UTC datetime objects or UTC timestamps (as per datetime.utcfromtimestamp) representing the times of observations
+    dt : array_like of datetime, datetime64 or float
+        UTC datetime objects, numpy.datetime64 values or UTC timestamps (as per datetime.utcfromtimestamp) representing the times of observations
     latitude, longitude : array_like of float
         decimal degrees, positive for north of the equator and east of Greenwich
     elevation : array_like of float
@@ -573,6 +1110,35 @@ def sunpos(dt, latitude, longitude, elevation, temperature=None, pressure=None,
         seconds, default is 0, difference between the earth's rotation time (TT) and universal time (UT)
     radians : bool, optional
         return results in radians if True, degrees if False (default)
+    vectorize : bool, optional
+        if True (default), evaluate every point at once with array operations,
+        otherwise evaluate the points one at a time (the scalar reference implementation)
+    ephemeris : None, str or ndarray, optional
+        Chebyshev ephemeris records from fit_ephemeris or load_ephemeris, or the name of a .npy file holding them,
+        to use instead of the full periodic-term series. Default is None (full series)
+    cache : None or SunposCache, optional
+        cache of the time-dependent part of the computation, to reuse between calls with the same times. Default is None
+    columns : None or sequence of int, optional
+        indices of the coordinates to compute (see Returns), default is all 5
+    out : None or ndarray, optional
+        array to write the results to, for example a numpy.memmap, instead of allocating a new one.
+        Must have the shape of the results
+    dtype : None or dtype, optional
+        data type of the results when out is None, default is float64
+    chunk_size : None or int, optional
+        evaluate this many entries of the first broadcast dimension at a time, to bound the memory used
+        for intermediate values. Default is None (everything at once)
+    workers : None or int, optional
+        number of worker processes to split the computation over, default is None (no worker processes).
+        Results are identical to the serial computation
+    executor : None or executor, optional
+        a multiprocessing.Pool, concurrent.futures.ProcessPoolExecutor or similar to run the worker chunks on
+        instead of starting a new pool. Default is None
+    precision : None or float, optional
+        required accuracy in degrees. Periodic terms are dropped, smallest first, while the sum of their largest
+        contributions over 1900 - 2100 stays below it (see README for the measured errors). Default is None (all terms)
+    float32 : bool, optional
+        evaluate the periodic terms in single precision, default is False
 
     Returns
     -------
@@ -583,6 +1149,7 @@ def sunpos(dt, latitude, longitude, elevation, temperature=None, pressure=None,
         coords[...,2] = topocentric right ascension
         coords[...,3] = topocentric declination
         coords[...,4] = topocentric hour angle
+        If columns is given, the final dimension holds only those coordinates, in that order
     """
 
     if temperature is None:
@@ -590,16 +1157,252 @@ def sunpos(dt, latitude, longitude, elevation, temperature=None, pressure=None,
     if pressure is None:
         pressure = 1013
     
+    if columns is None:
+        columns = (0, 1, 2, 3, 4)
+    
     #6367444 = radius of earth
-    #numpy broadcasting
-    b = np.broadcast(dt,latitude,longitude,elevation,temperature,pressure,delta_t)
-    res = np.empty(b.shape+(5,))
-    res_vec = res.reshape((-1,5))
-    for i,x in enumerate(b):
-        res_vec[i] = _sp.pos(*x)
-    if radians:
-        res = np.deg2rad(res)
-    return res
+    args = (dt,latitude,longitude,elevation,temperature,pressure,delta_t)
+    kwargs = dict(ephemeris=ephemeris, cache=cache, term_set=_sp.periodic_terms(precision, float32))
+    return _evaluate(_sp.pos, columns, args, kwargs, vectorize, radians, out, dtype, chunk_size, workers, executor)
+
+def sunpos_grid(dt, latitude, longitude, elevation, temperature=None, pressure=None, delta_t=0, radians=False, ephemeris=None, cache=None, columns=None, out=None, dtype=None, chunk_size=None, workers=None, executor=None, precision=None, float32=False):
+    """Compute the observed and topocentric coordinates of the sun for every combination of time and site.
+
+    The time-dependent part of the algorithm (heliocentric position, nutation, geocentric RA/dec, sidereal time)
+    is evaluated once per time and shared by all of the sites.
+
+    Parameters
+    ----------
+    dt : array_like of datetime, datetime64 or float
+        UTC datetime objects, numpy.datetime64 values or UTC timestamps (as per datetime.utcfromtimestamp) representing the times of observations
+    latitude, longitude : array_like of float
+        decimal degrees, positive for north of the equator and east of Greenwich
+    elevation : array_like of float
+        meters, relative to the WGS-84 ellipsoid
+    temperature : None or array_like of float, optional
+        celcius, default is 14.6 (global average in 2013)
+    pressure : None or array_like of float, optional
+        millibar, default is 1013 (global average in ??)
+    delta_t : array_like of float, optional
+        seconds, default is 0, difference between the earth's rotation time (TT) and universal time (UT)
+        broadcast with dt
+    radians : bool, optional
+        return results in radians if True, degrees if False (default)
+    ephemeris : None, str or ndarray, optional
+        Chebyshev ephemeris records from fit_ephemeris or load_ephemeris, or the name of a .npy file holding them,
+        to use instead of the full periodic-term series. Default is None (full series)
+    cache : None or SunposCache, optional
+        cache of the time-dependent part of the computation, to reuse between calls with the same times. Default is None
+    columns : None or sequence of int, optional
+        indices of the coordinates to compute (see Returns), default is all 5
+    out : None or ndarray, optional
+        array to write the results to, for example a numpy.memmap, instead of allocating a new one.
+        Must have the shape of the results
+    dtype : None or dtype, optional
+        data type of the results when out is None, default is float64
+    chunk_size : None or int, optional
+        evaluate this many entries of the first broadcast dimension at a time, to bound the memory used
+        for intermediate values. Default is None (everything at once)
+    workers : None or int, optional
+        number of worker processes to split the computation over, default is None (no worker processes).
+        Results are identical to the serial computation
+    executor : None or executor, optional
+        a multiprocessing.Pool, concurrent.futures.ProcessPoolExecutor or similar to run the worker chunks on
+        instead of starting a new pool. Default is None
+    precision : None or float, optional
+        required accuracy in degrees. Periodic terms are dropped, smallest first, while the sum of their largest
+        contributions over 1900 - 2100 stays below it (see README for the measured errors). Default is None (all terms)
+    float32 : bool, optional
+        evaluate the periodic terms in single precision, default is False
+
+    Returns
+    -------
+    coords : ndarray, (...,5)
+        The shape of the array is dt and delta_t broadcast together, followed by the site parameters
+        (latitude, longitude, elevation, temperature, pressure) broadcast together, plus a final dimension for the coordinates,
+        in the same order as sunpos.
+    """
+    if temperature is None:
+        temperature = 14.6
+    if pressure is None:
+        pressure = 1013
+
+    dt, delta_t = np.broadcast_arrays(np.asarray(dt), delta_t)
+    site_shape = np.broadcast(latitude, longitude, elevation, temperature, pressure).shape
+    #add trailing dimensions to the times so they broadcast against the sites as an outer product
+    expand = (Ellipsis,) + (np.newaxis,)*len(site_shape)
+    return sunpos(dt[expand], latitude, longitude, elevation, temperature, pressure, delta_t[expand], radians,
+                  ephemeris=ephemeris, cache=cache, columns=columns, out=out, dtype=dtype, chunk_size=chunk_size,
+                  workers=workers, executor=executor, precision=precision, float32=float32)
+
+def iter_sunpos(dt_chunks, latitude, longitude, elevation, temperature=None, pressure=None, delta_t=0, radians=False, ephemeris=None, cache=None, columns=None, dtype=None, precision=None, float32=False):
+    """Compute the observed and topocentric coordinates of the sun for a stream of time chunks.
+
+    Parameters
+    ----------
+    dt_chunks : iterable of array_like
+        chunks of UTC datetime objects, numpy.datetime64 values or UTC timestamps, as for sunpos
+    latitude, longitude, elevation, temperature, pressure, delta_t, radians, ephemeris, cache, columns, dtype, precision, float32
+        as for sunpos, broadcast against each chunk of times
+
+    Yields
+    ------
+    coords : ndarray
+        sunpos(chunk, ...) for each chunk in turn
+    """
+    if isinstance(ephemeris, str):
+        ephemeris = load_ephemeris(ephemeris)
+    for dt in dt_chunks:
+        yield sunpos(dt, latitude, longitude, elevation, temperature, pressure, delta_t, radians,
+                     ephemeris=ephemeris, cache=cache, columns=columns, dtype=dtype, precision=precision, float32=float32)
+
+def sun_rise_transit_set(dt, latitude, longitude, zenith=90.8333, delta_t=0, return_polar=False):
+    """Compute the times of solar transit, sunrise and sunset on the given days.
+
+    Each day costs three evaluations of the time-dependent part of the algorithm, shared by all of the sites,
+    instead of sampling sunpos over the day.
+
+    Parameters
+    ----------
+    dt : array_like of datetime, datetime64 or float
+        UTC datetime objects, numpy.datetime64 values or UTC timestamps (as per datetime.utcfromtimestamp) on the days of interest,
+        the time of day is ignored
+    latitude, longitude : array_like of float
+        decimal degrees, positive for north of the equator and east of Greenwich
+    zenith : array_like of float, optional
+        zenith angle of the sun's center at rise and set, in degrees. The default of 90.8333 accounts for refraction and the
+        sun's radius, use 96, 102 or 108 for civil, nautical or astronomical twilight
+    delta_t : array_like of float, optional
+        seconds, default is 0, difference between the earth's rotation time (TT) and universal time (UT)
+    return_polar : bool, optional
+        also return which days have no sunrise and sunset because the sun stays up or down. Default is False
+
+    Returns
+    -------
+    times : ndarray of datetime64, (...,3)
+        The shape of the array is parameters broadcast together, plus a final dimension for the events.
+        times[...,0] = transit
+        times[...,1] = sunrise
+        times[...,2] = sunset
+        sunrise and sunset are the ones either side of the transit on that UTC day, so they can fall on the previous or the
+        next UTC day, they are NaT on days when the sun stays above or below the given zenith angle
+    polar : ndarray of int8, (...)
+        only returned if return_polar is True. 1 where the sun stays above the zenith angle all day (polar day),
+        -1 where it stays below (polar night), 0 where it rises and sets
+
+    Examples
+    --------
+    Tromso, north of the arctic circle, has polar day at the June solstice and polar night at the December solstice
+
+    >>> days = np.array(['2019-06-21', '2019-12-21'], dtype='datetime64[D]')
+    >>> times, polar = sun_rise_transit_set(days, 69.65, 18.96, return_polar=True)
+    >>> times[:,1]
+    array(['NaT', 'NaT'], dtype='datetime64[us]')
+    >>> polar
+    array([ 1, -1], dtype=int8)
+    """
+    jd = _sp.julian_day(np.asarray(dt))
+    jd0 = np.floor(jd - 0.5) + 0.5
+    T, R, S, polar = _sp.rise_transit_set(jd0, latitude, longitude, 90 - np.asarray(zenith, dtype=float), delta_t)
+    days = np.array(np.broadcast_arrays(T, R, S))
+    days = np.moveaxis(days, 0, -1) + np.asarray(jd0)[...,None]
+    us = np.round((days - 2440587.5)*(86400*1e6))
+    times = np.datetime64('1970-01-01T00:00:00', 'us') + np.where(np.isnan(us), 0, us).astype('timedelta64[us]')
+    times[np.isnan(us)] = np.datetime64('NaT')
+    if return_polar:
+        return times, np.broadcast_to(polar, times.shape[:-1]).copy()
+    return times
+
+def fit_ephemeris(first_year, last_year, segment_days=8.0, degree=13):
+    """Fit the time-dependent solar quantities with piecewise Chebyshev polynomials.
+
+    The fitted quantities are those returned by _sp.sun_ephemeris: geocentric right ascension and declination,
+    Earth heliocentric radius, nutation in longitude and true obliquity of the ecliptic, as functions of the
+    Julian Ephemeris Day. The apparent sidereal time is computed from the fitted nutation and obliquity.
+
+    Parameters
+    ----------
+    first_year, last_year : int
+        range of years (UTC, inclusive) covered by the fit
+    segment_days : float, optional
+        length of each polynomial segment in days, default is 8
+    degree : int, optional
+        degree of the Chebyshev polynomial of each segment, default is 13
+
+    Returns
+    -------
+    records : ndarray, (segments, 2 + 5*(degree+1))
+        records[:,0] = Julian Ephemeris Day at the start of each segment
+        records[:,1] = Julian Ephemeris Day at the end of each segment
+        records[:,2:] = Chebyshev coefficients for each quantity in turn, lowest order first
+    """
+    #a day of margin on either side covers any reasonable delta_t
+    start = _sp.julian_day(datetime(first_year, 1, 1)) - 1
+    end = _sp.julian_day(datetime(last_year + 1, 1, 1)) + 1
+    nseg = int(np.ceil((end - start)/segment_days))
+    starts = start + segment_days*np.arange(nseg)
+
+    #interpolate at the Chebyshev nodes of each segment
+    n = degree + 1
+    x = np.cos(np.pi*(np.arange(n) + 0.5)/n)
+    jde = starts[:,None] + (x + 1)*(segment_days/2.0)
+    q = np.array(_sp.sun_ephemeris(jde))
+    #right ascension wraps at 360, make it continuous within each segment
+    q[0] = np.rad2deg(np.unwrap(np.deg2rad(q[0]), axis=1))
+
+    V = np.cos(np.outer(np.arccos(x), np.arange(n)))
+    nq = len(_sp._CHEB_QUANTITIES_)
+    coef = np.linalg.solve(V, q.reshape(nq*nseg, n).T)
+    coef = coef.reshape(n, nq, nseg).transpose(2, 1, 0)
+
+    records = np.empty((nseg, 2 + nq*n))
+    records[:,0] = starts
+    records[:,1] = starts + segment_days
+    records[:,2:] = coef.reshape(nseg, nq*n)
+    return records
+
+def ephemeris_error(records, samples=100000, seed=0):
+    """Maximum error of Chebyshev ephemeris records against the full algorithm.
+
+    Parameters
+    ----------
+    records : ndarray
+        Chebyshev ephemeris records from fit_ephemeris or load_ephemeris
+    samples : int, optional
+        number of random times to compare at, default is 100000
+    seed : int, optional
+        random seed for the comparison times, default is 0
+
+    Returns
+    -------
+    err : ndarray, (5,)
+        maximum absolute error of alpha, delta (degrees), R (AU), delta_psi and epsilon (degrees)
+    """
+    rs = np.random.RandomState(seed)
+    jde = rs.uniform(records[0,0], records[-1,1], samples)
+    jde = jde[jde < records[-1,1]]
+    full = np.array(_sp.sun_ephemeris(jde))
+    fit = np.array(_sp.chebyshev_ephemeris(records, jde))
+    diff = fit - full
+    diff[0] = (diff[0] + 180) % 360 - 180
+    return np.abs(diff).max(axis=1)
+
+def load_ephemeris(filename):
+    """Memory-map Chebyshev ephemeris records saved with numpy.save(filename, fit_ephemeris(...))"""
+    return np.load(filename, mmap_mode='r')
+
+_LOADED_EPHEMERIDES_ = {}
+
+def _loaded_ephemeris(filename):
+    """load_ephemeris(filename), mapped once for as long as the file isn't modified, so that calls naming the same file
+        share the records (and their SunposCache entries)
+    """
+    path = os.path.abspath(filename)
+    stamp = os.stat(path).st_mtime, os.stat(path).st_size
+    entry = _LOADED_EPHEMERIDES_.get(path)
+    if entry is None or entry[0] != stamp:
+        entry = _LOADED_EPHEMERIDES_[path] = (stamp, load_ephemeris(path))
+    return entry[1]
 
 def main(args):
     az, zen, ra, dec, h = sunpos(args.t, args.lat, args.lon, args.elev, args.temp, args.p, args.dt, args.rad)